@@ -0,0 +1,405 @@
+"""
+Benchmarks for the statin site renderer
+
+Generates a synthetic site of a given size, then times cold, warm and incremental builds of it with perform_build.
+Each build runs in its own process so its peak memory use can be measured on its own. Results come out as JSON, so
+runs can be kept and compared between releases:
+
+    python bench.py --articles 2000 --posts 500 --output before.json
+
+The synthetic site has:
+
+    - Markdown articles spread over a nested directory tree, rendered through an _auto-md.jinja2 template
+    - Markdown blog posts in a "type: blog" directory, with an index page listing all of them
+    - Listing pages that grab and select from every article
+    - Large static assets
+    - JPEG photos in a directory that asks for resized derivatives of them, if PIL is available. Every cold build
+      checks the derivatives were made.
+"""
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+import multiprocessing
+from optparse import OptionParser
+from path import path
+
+import build
+
+
+BASE_TEMPLATE = """<!DOCTYPE html>
+<html>
+    <head>
+        <meta charset="utf-8">
+        <title>{% if page_title %}{{ page_title }}{% endif %}</title>
+    </head>
+    <body>
+        {% block content %}{% endblock %}
+    </body>
+</html>
+"""
+
+ARTICLE_TEMPLATE = """{% extends '_base.jinja2' %}
+{% block content %}
+    <article>
+        {% markdown %}
+        {{ content }}
+        {% endmarkdown %}
+    </article>
+{% endblock %}
+"""
+
+LISTING_TEMPLATE = """{%% extends '_base.jinja2' %%}
+{%% block content %%}
+    {%% for article in glob('%(pattern)s') %%}
+        <article>
+            <h4><a href="{{ map(article) }}">{{ select(grab(article).as_html(), 'h1').text() }}</a></h4>
+            <p>{{ select(grab(article).as_html(), 'h1 + p').text() }}</p>
+        </article>
+    {%% endfor %%}
+    {%% for post in dispatch_type('blog').posts %%}
+        <p><a href="{{ to_root }}/{{ post.uri }}">{{ post.title }}</a></p>
+    {%% endfor %%}
+{%% endblock %%}
+"""
+
+BLOG_INDEX = """---
+type: blog
+index_renderer: index.jinja2
+post_renderer: post.jinja2
+"""
+
+BLOG_INDEX_TEMPLATE = """{% extends '_base.jinja2' %}
+{% block content %}
+    {% for post in posts %}
+        <article>
+            <h4><a href="{{ to_root }}/{{ post.uri }}">{{ post.posted }} {{ post.title }}</a></h4>
+            <p>{{ post.excerpt }}</p>
+        </article>
+    {% endfor %}
+{% endblock %}
+"""
+
+BLOG_POST_TEMPLATE = """{% extends '_base.jinja2' %}
+{% block content %}
+    {{ post.html }}
+{% endblock %}
+"""
+
+PHOTO_WIDTHS = (160, 320)
+
+PHOTOS_INDEX = """---
+images:
+  widths: [%s]
+""" % ", ".join(str(width) for width in PHOTO_WIDTHS)
+
+WORDS = ("static site render template markdown article blog post listing cache build output source directory "
+         "handler mapper type index page content heading paragraph link image asset").split()
+
+
+def paragraph(rand, words=60):
+    """
+    Some filler text
+
+    @param rand: Random number generator
+    @type rand: random.Random
+    @param words: Number of words
+    @type words: int
+    @return: Paragraph of text
+    @rtype: str
+    """
+    return " ".join(rand.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def markdown_document(rand, title, paragraphs=6):
+    """
+    A Markdown document with a title, a few sections and a link
+
+    @param rand: Random number generator
+    @type rand: random.Random
+    @param title: Top level heading
+    @type title: str
+    @param paragraphs: Number of paragraphs
+    @type paragraphs: int
+    @return: Markdown
+    @rtype: str
+    """
+    lines = ["# %s" % title, ""]
+    for i in range(paragraphs):
+        if i and i % 2 == 0:
+            lines += ["## Section %d" % i, ""]
+        lines += [paragraph(rand), ""]
+    lines += ["See the [index](/index.html) for more.", ""]
+    return "\n".join(lines)
+
+
+def generate_site(site_dir, articles=200, posts=100, depth=4, listings=5, assets=5, asset_size=1024 * 1024, seed=0,
+                  page_size=None, photos=0):
+    """
+    Write out a synthetic site
+
+    @param site_dir: Directory to create the source directory in
+    @type site_dir: path
+    @param articles: Number of Markdown articles
+    @type articles: int
+    @param posts: Number of blog posts
+    @type posts: int
+    @param depth: How deeply the articles are nested
+    @type depth: int
+    @param listings: Number of listing pages that grab every article
+    @type listings: int
+    @param assets: Number of static assets
+    @type assets: int
+    @param asset_size: Size of each static asset in bytes
+    @type asset_size: int
+    @param seed: Random seed, the same seed always gives the same site
+    @type seed: int
+    @param page_size: Posts per page of the blog index, or None for a single index page
+    @type page_size: int|None
+    @param photos: Number of JPEG photos to make derivatives of, none are made without PIL
+    @type photos: int
+    @return: Source directory, and the article to change in the incremental build
+    @rtype: tuple
+    """
+    rand = random.Random(seed)
+    source_dir = site_dir.joinpath('source')
+    source_dir.makedirs_p()
+    source_dir.joinpath('_base.jinja2').write_text(BASE_TEMPLATE)
+
+    articles_dir = source_dir.joinpath('articles')
+    articles_dir.makedirs_p()
+    articles_dir.joinpath('_auto-md.jinja2').write_text(ARTICLE_TEMPLATE)
+    article_paths = []
+    for i in range(articles):
+        level = i % (depth + 1)
+        dir_path = articles_dir.joinpath(*["level-%d" % n for n in range(level)]) if level else articles_dir
+        dir_path.makedirs_p()
+        article_path = dir_path.joinpath("article-%d.md" % i)
+        article_path.write_text(markdown_document(rand, "Article %d" % i))
+        article_paths.append(article_path)
+
+    blog_dir = source_dir.joinpath('blog')
+    blog_dir.makedirs_p()
+    blog_dir.joinpath('_index.yml').write_text(BLOG_INDEX + ("page_size: %d\n" % page_size if page_size else ""))
+    blog_dir.joinpath('index.jinja2').write_text(BLOG_INDEX_TEMPLATE)
+    blog_dir.joinpath('post.jinja2').write_text(BLOG_POST_TEMPLATE)
+    posted = datetime(2013, 1, 1)
+    for i in range(posts):
+        posted += timedelta(hours=7)
+        name = "%s-Post-%d.md" % (posted.strftime("%Y-%m-%d-%H-%M"), i)
+        blog_dir.joinpath(name).write_text(markdown_document(rand, "Post %d" % i, paragraphs=4))
+
+    for i in range(listings):
+        pattern = "/".join(['articles'] + ["level-%d" % n for n in range(i % (depth + 1))] + ['*.md'])
+        source_dir.joinpath("listing-%d.jinja2" % i).write_text(LISTING_TEMPLATE % dict(pattern=pattern))
+
+    static_dir = source_dir.joinpath('static')
+    static_dir.makedirs_p()
+    for i in range(assets):
+        static_dir.joinpath("asset-%d.bin" % i).write_bytes(os.urandom(asset_size))
+
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+        if photos:
+            print >> sys.stderr, "PIL isn't available, leaving the photos out"
+    if photos and Image:
+        photos_dir = source_dir.joinpath('photos')
+        photos_dir.makedirs_p()
+        photos_dir.joinpath('_index.yml').write_text(PHOTOS_INDEX)
+        for i in range(photos):
+            color = tuple(rand.randint(0, 255) for channel in range(3))
+            Image.new('RGB', (640, 480), color).save(photos_dir.joinpath("photo-%d.jpg" % i), 'JPEG')
+
+    return source_dir, (article_paths[len(article_paths) // 2] if article_paths else None)
+
+
+def timed_build(source_dir, dest_dir, cache_dir, jobs, results):
+    """
+    Run one build and put its timings on the results queue. Runs in its own process.
+
+    @param source_dir: Source directory
+    @type source_dir: path
+    @param dest_dir: Destination directory
+    @type dest_dir: path
+    @param cache_dir: Build cache directory
+    @type cache_dir: path
+    @param jobs: Number of processes to render with
+    @type jobs: int
+    @param results: Queue to put the timings on
+    @type results: multiprocessing.Queue
+    """
+    sys.stdout = open(os.devnull, 'w')
+    wall = time.time()
+    before = os.times()
+    try:
+        builder = build.perform_build(source_dir, dest_dir, jobs=jobs, cache_dir=cache_dir)
+    except Exception:
+        results.put(dict(error=traceback.format_exc()))
+        raise
+    after = os.times()
+    wall = time.time() - wall
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss = max(peak_rss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put(dict(wall=wall, cpu=sum(after[:4]) - sum(before[:4]), peak_rss_kb=peak_rss,
+                     rebuilt=len(builder.env.cache.rebuilt), skipped=len(builder.env.cache.skipped)))
+
+
+def run_build(source_dir, dest_dir, cache_dir, jobs):
+    """
+    Time a build in a fresh process
+
+    @param source_dir: Source directory
+    @type source_dir: path
+    @param dest_dir: Destination directory
+    @type dest_dir: path
+    @param cache_dir: Build cache directory
+    @type cache_dir: path
+    @param jobs: Number of processes to render with
+    @type jobs: int
+    @return: Timings
+    @rtype: dict
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=timed_build, args=(source_dir, dest_dir, cache_dir, jobs, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError("Build failed:\n%s" % result['error'])
+    return result
+
+
+def check_photos(source_dir, dest_dir):
+    """
+    Check every generated photo was published along with a derivative at each width
+
+    @param source_dir: Source directory
+    @type source_dir: path
+    @param dest_dir: Destination directory
+    @type dest_dir: path
+    @raise RuntimeError: Some are missing
+    """
+    photos_dir = source_dir.joinpath('photos')
+    if not photos_dir.isdir():
+        return
+    missing = []
+    for photo_path in sorted(photos_dir.files('*.jpg')):
+        dest_path = dest_dir.joinpath('photos', photo_path.name)
+        expected = [dest_path] + [dest_path.parent.joinpath("%s-%d.jpg" % (dest_path.namebase, width))
+                                  for width in PHOTO_WIDTHS]
+        missing.extend(str(dest_dir.relpathto(p)) for p in expected if not p.isfile())
+    if missing:
+        raise RuntimeError("Build didn't publish %s" % ", ".join(missing))
+
+
+def run_scenarios(source_dir, changed_path, work_dir, runs=3, jobs=1):
+    """
+    Time cold, warm and incremental builds of a site
+
+    @param source_dir: Source directory
+    @type source_dir: path
+    @param changed_path: Source file to change for the single file change build
+    @type changed_path: path|None
+    @param work_dir: Directory for the output and build cache
+    @type work_dir: path
+    @param runs: How many times to run each scenario
+    @type runs: int
+    @param jobs: Number of processes to render with
+    @type jobs: int
+    @return: Results per scenario, with the best wall time and every run
+    @rtype: dict
+    """
+    dest_dir = work_dir.joinpath('output')
+    cache_dir = work_dir.joinpath('cache')
+    scenarios = dict(cold=[], warm=[], change=[], template=[])
+
+    for run in range(runs):
+        print >> sys.stderr, "Run %d of %d" % (run + 1, runs)
+        # Cold means nothing to reuse, not even outputs that write-if-changed would leave alone
+        for d in (cache_dir, dest_dir):
+            if d.exists():
+                d.rmtree()
+        dest_dir.makedirs_p()
+
+        scenarios['cold'].append(run_build(source_dir, dest_dir, cache_dir, jobs))
+        check_photos(source_dir, dest_dir)
+        scenarios['warm'].append(run_build(source_dir, dest_dir, cache_dir, jobs))
+
+        if changed_path:
+            changed_path.write_text("\nChanged in run %d.\n" % run, append=True)
+            scenarios['change'].append(run_build(source_dir, dest_dir, cache_dir, jobs))
+
+            template_path = changed_path.parent.joinpath('_auto-md.jinja2')
+            if not template_path.exists():
+                template_path = source_dir.joinpath('articles', '_auto-md.jinja2')
+            template_path.write_text("{# Changed in run %d #}\n" % run, append=True)
+            scenarios['template'].append(run_build(source_dir, dest_dir, cache_dir, jobs))
+
+    summary = dict()
+    for (name, results) in scenarios.items():
+        if not results:
+            continue
+        summary[name] = dict(min(results, key=lambda result: result['wall']))
+        summary[name]['runs'] = results
+    return summary
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--articles", type="int", default=200,
+                      help = "Number of Markdown articles")
+    parser.add_option("--posts", type="int", default=100,
+                      help = "Number of blog posts")
+    parser.add_option("--depth", type="int", default=4,
+                      help = "How deeply the articles are nested")
+    parser.add_option("--listings", type="int", default=5,
+                      help = "Number of listing pages that grab and select from every article at one level")
+    parser.add_option("--assets", type="int", default=5,
+                      help = "Number of large static assets")
+    parser.add_option("--asset-size", type="int", default=1024,
+                      help = "Size of each static asset in KB")
+    parser.add_option("--photos", type="int", default=5,
+                      help = "Number of JPEG photos to make resized derivatives of (needs PIL)")
+    parser.add_option("--page-size", type="int", default=None,
+                      help = "Paginate the blog index with this many posts per page")
+    parser.add_option("--seed", type="int", default=0,
+                      help = "Random seed for the generated content")
+    parser.add_option("--runs", type="int", default=3,
+                      help = "How many times to run each scenario, the best time is reported")
+    parser.add_option("--jobs","-j", type="int", default=1,
+                      help = "Number of processes to render with")
+    parser.add_option("--work-dir", type="string", default=None,
+                      help = "Where to generate the site and build it, kept afterwards (default: a temporary dir)")
+    parser.add_option("--output","-o", type="string", default=None,
+                      help = "Write the results as JSON to this file rather than stdout")
+    (options, args) = parser.parse_args()
+
+    work_dir = path(options.work_dir or tempfile.mkdtemp(prefix='statin-bench-'))
+    try:
+        site = dict(articles=options.articles, posts=options.posts, depth=options.depth, listings=options.listings,
+                    assets=options.assets, asset_size=options.asset_size * 1024, seed=options.seed,
+                    page_size=options.page_size, photos=options.photos)
+        print >> sys.stderr, "Generating site in %s" % work_dir
+        (source_dir, changed_path) = generate_site(work_dir.joinpath('site'), **site)
+
+        results = dict(python=platform.python_version(), platform=platform.platform(),
+                       cpus=multiprocessing.cpu_count(), jobs=options.jobs, runs=options.runs, site=site,
+                       scenarios=run_scenarios(source_dir, changed_path, work_dir, runs=options.runs,
+                                               jobs=options.jobs))
+    finally:
+        if not options.work_dir:
+            work_dir.rmtree()
+
+    if options.output:
+        json.dump(results, open(options.output, 'w'), indent=1, sort_keys=True)
+    else:
+        print json.dumps(results, indent=1, sort_keys=True)
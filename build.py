@@ -4,11 +4,8 @@ Current issues:
 
  * Build docs and put them in gh-pages so that people can read them or something
  * Document -v switch
- * Warn if lessc isn't available
  * Determine how to wrap HTML nicely
    * Modify CSS, static element paths, leave everything else alone?
- * You can probably go into an infinite loop pretty easily using grab
- * Image resizing/conversion
  * Perhaps create a couple of intermediate classes for things like HTMLOutputFile or something
  * Blogs are shit.
    * Indexes, possibly with javascript to allow sorting / pagination
@@ -31,21 +28,40 @@ Current issues:
    * Date formatter
    * Maybe a sidebar or something
    * <-- more --> support?
-   * Need to process blog before we do final render for the rest of the site so that, say, the index page can ref the
-     blog posts - or could have a get_type that does the type processing for the blog first then hands it back
 
  WARNING/TODO: DO NOT FORGET YOU'RE USING A GIT VERSION OF CSSSELECT TO SUPPORT :first
 
 
- So, maybe it should be a two-phase operation. Phase one builds a tree of the source, with each element doing as much
- no-dependency processing as possible. The second phase then compiles the tree and writes it out.
+ The build is a two-phase operation. Phase one scans the source into a BuildPlan of source, type and output nodes
+ without rendering anything. The second phase runs the nodes in dependency order and writes everything out.
 
 """
+from collections import OrderedDict
 from datetime import datetime
 import sys
+import threading
 import time
 
 import os, re, jinja2, markdown2
+import subprocess
+import contextlib
+import hashlib
+import heapq
+import importlib
+import io
+from distutils.spawn import find_executable
+import fnmatch
+import glob
+import json
+import mimetypes
+import multiprocessing
+import posixpath
+import Queue
+import stat
+import traceback
+import urllib
+import BaseHTTPServer
+from multiprocessing.pool import ThreadPool
 import jinja2.ext
 from path import path
 from pyquery import PyQuery as pq
@@ -56,6 +72,9 @@ import yaml
 logging.basicConfig(level=logging.WARN)
 log = logging.getLogger('statin')
 
+# Extra markdown2 features used everywhere we convert Markdown
+MARKDOWN_EXTRAS = ['fenced-code-blocks', 'footnotes', 'header-ids']
+
 
 class Markdown2Extension(jinja2.ext.Extension):
     """
@@ -80,7 +99,7 @@ class Markdown2Extension(jinja2.ext.Extension):
     def __init__(self, environment):
         super(Markdown2Extension, self).__init__(environment)
         environment.extend(
-            markdowner=markdown2.Markdown(extras=['fenced-code-blocks','footnotes','header-ids'])
+            markdowner=markdown2.Markdown(extras=MARKDOWN_EXTRAS)
         )
 
     def parse(self, parser):
@@ -129,6 +148,429 @@ class Markdown2Extension(jinja2.ext.Extension):
         return html
 
 
+# Compiled templates refer to the extension by this name, which would otherwise be __main__.Markdown2Extension or
+# build.Markdown2Extension depending on how statin was started, so the bytecode cache only worked from one of them
+Markdown2Extension.identifier = 'statin.Markdown2Extension'
+
+
+class RecordingEnvironment(jinja2.Environment):
+    """
+    Jinja2 environment that reports every template it loads to the build, so that extends, include and import show up
+    as dependencies of whatever is being rendered
+    """
+    statin_env = None
+
+    def get_template(self, name, parent=None, globals=None):
+        if self.statin_env and isinstance(name, basestring):
+            self.statin_env.depend('file', self.statin_env.source_dir.joinpath(self.join_path(name, parent)))
+        return super(RecordingEnvironment, self).get_template(name, parent, globals)
+
+
+class LRUCache(object):
+    """
+    Bounded cache that drops the least recently used entry when full, counting hits and misses as it goes
+    """
+    size = None
+    hits = 0
+    misses = 0
+
+    def __init__(self, size):
+        """
+        @param size: Most entries to hold
+        @type size: int
+        """
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Fetch an entry, marking it as recently used
+
+        @param key: Key
+        @param default: Returned on a miss
+        @return: Cached value, or default
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Store an entry, evicting the least recently used ones if that takes us over size
+
+        @param key: Key
+        @param value: Value
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def trim_cache_dir(cache_dir, max_bytes, written, size_name='size'):
+    """
+    Drop the least recently used (by mtime) files from a cache directory until it fits in max_bytes. The total size is
+    kept in a file in the directory, so it's only scanned when what's been added since takes the total past max_bytes,
+    or there's no recorded total.
+
+    @param cache_dir: Cache directory
+    @type cache_dir: path
+    @param max_bytes: Most bytes to keep
+    @type max_bytes: int
+    @param written: Bytes added to the cache since it was last trimmed
+    @type written: int
+    @param size_name: Name of the file holding the total
+    @type size_name: str
+    """
+    if not written or not cache_dir.isdir():
+        return
+
+    size_path = cache_dir.joinpath(size_name)
+    try:
+        total = int(open(size_path, 'r').read()) + written
+    except (IOError, ValueError):
+        total = None
+
+    if total is None or total > max_bytes:
+        entries = sorted((p.mtime, p.size, p) for p in cache_dir.walkfiles() if p != size_path)
+        total = sum(size for (mtime, size, p) in entries)
+        for (mtime, size, p) in entries:
+            if total <= max_bytes:
+                break
+            log.debug("Dropping cached %s" % p)
+            p.remove_p()
+            total -= size
+
+    temp_path = size_path + '.%d.tmp' % os.getpid()
+    open(temp_path, 'w').write(str(total))
+    temp_path.rename(size_path)
+
+
+def content_hash(content):
+    """
+    Hash a piece of content, text or bytes
+
+    @param content: Content
+    @type content: str|unicode
+    @return: Hex digest
+    @rtype: str
+    """
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+class MarkdownCache(object):
+    """
+    Markdown converter that remembers what it has converted, keyed by the hash of the text and the markdown2 extras in
+    use. Results are held in memory for the build and, given a directory, also kept on disk for later builds. The disk
+    cache is trimmed back to max_bytes by dropping the least recently used entries.
+
+    The total size of the disk cache is kept in a file alongside the entries, so a build that added nothing doesn't
+    need to look at the cache at all, and one that did only scans it once the total goes past max_bytes.
+    """
+    cache_dir = None
+    max_bytes = 64 * 1024 * 1024
+    disk_hits = 0
+    # Bytes added to the disk cache since it was last trimmed
+    written = 0
+    size_name = 'size'
+
+    def __init__(self, extras, cache_dir=None, size=1024):
+        """
+        @param extras: markdown2 extras
+        @type extras: list
+        @param cache_dir: Directory to keep converted HTML in between builds, or None to only cache in memory
+        @type cache_dir: str|unicode|None
+        @param size: Most conversions to hold in memory
+        @type size: int
+        """
+        self.extras = list(extras)
+        self.markdown = markdown2.Markdown(extras=self.extras)
+        self.memory = LRUCache(size)
+        if cache_dir:
+            self.cache_dir = path(cache_dir).abspath()
+
+    def convert(self, text):
+        """
+        Convert Markdown to HTML
+
+        @param text: Markdown
+        @type text: str|unicode
+        @return: HTML
+        @rtype: unicode
+        """
+        key = content_hash(text if isinstance(text, unicode) else text.decode('utf-8'))
+        key = content_hash("%s:%s" % (",".join(sorted(self.extras)), key))
+
+        html = self.memory.get(key)
+        if html is not None:
+            return html
+
+        cached_path = self.cache_dir.joinpath(key[:2], key) if self.cache_dir else None
+        if cached_path and cached_path.exists():
+            html = open(cached_path, 'rb').read().decode('utf-8')
+            self.disk_hits += 1
+            # Touch it so trimming sees it as recently used
+            cached_path.utime(None)
+        else:
+            html = unicode(self.markdown.convert(text))
+            if cached_path:
+                if not cached_path.parent.isdir():
+                    cached_path.parent.makedirs_p()
+                # Write then rename, so parallel builds never see half an entry
+                temp_path = cached_path + '.%d.tmp' % os.getpid()
+                content = html.encode('utf-8')
+                open(temp_path, 'wb').write(content)
+                temp_path.rename(cached_path)
+                self.written += len(content)
+
+        self.memory.put(key, html)
+        return html
+
+    def trim(self):
+        """
+        Drop the least recently used entries from the disk cache until it fits in max_bytes. Only scans the cache when
+        what's been added since the last trim takes the recorded total past max_bytes, or there's no recorded total.
+        """
+        if not self.cache_dir:
+            return
+
+        trim_cache_dir(self.cache_dir, self.max_bytes, self.written, self.size_name)
+        self.written = 0
+
+
+class SourceEntry(object):
+    """
+    A file or directory in the source index
+    """
+    file_path = None
+    stat = None
+    names = None
+
+    def __init__(self, file_path, st):
+        """
+        @param file_path: Absolute path
+        @type file_path: path
+        @param st: Result of os.stat
+        """
+        self.file_path = file_path
+        self.stat = st
+        if self.is_dir:
+            # Directory listing, in the order the filesystem gave it to us
+            self.names = []
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.stat.st_mode)
+
+
+class SourceIndex(object):
+    """
+    In-memory snapshot of the source tree, with stat info for every entry, parsed _index.yml metadata for every
+    directory and compiled glob patterns. The tree is walked once and then kept up to date from lists of changed
+    paths, so in monitor mode it's never walked again.
+    """
+    source_dir = None
+
+    def __init__(self, source_dir):
+        """
+        @param source_dir: Source directory
+        @type source_dir: path
+        """
+        self.source_dir = path(source_dir).abspath()
+        self.entries = dict()
+        self.metas = dict()
+        self.patterns = dict()
+        self.globs = dict()
+        self.path_tables = dict()
+        if self.source_dir.isdir():
+            self.scan(self.source_dir, os.stat(self.source_dir))
+
+    def scan(self, dir_path, st):
+        """
+        Add a directory and everything beneath it
+
+        @param dir_path: Directory
+        @type dir_path: path
+        @param st: Result of os.stat for the directory
+        """
+        entry = SourceEntry(dir_path, st)
+        self.entries[dir_path] = entry
+        for name in os.listdir(dir_path):
+            self.add(entry, name)
+
+    def add(self, parent, name):
+        """
+        Add a single name to a directory entry
+
+        @param parent: Directory entry
+        @type parent: SourceEntry
+        @param name: Name within the directory
+        @type name: str|unicode
+        """
+        file_path = parent.file_path.joinpath(name)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            # Dangling symlink or already gone again
+            return
+
+        parent.names.append(name)
+        if stat.S_ISDIR(st.st_mode):
+            self.scan(file_path, st)
+        else:
+            self.entries[file_path] = SourceEntry(file_path, st)
+
+    def drop(self, file_path):
+        """
+        Remove an entry and everything beneath it
+
+        @param file_path: Path
+        @type file_path: path
+        """
+        entry = self.entries.pop(file_path, None)
+        if entry and entry.is_dir:
+            for name in entry.names:
+                self.drop(file_path.joinpath(name))
+        self.metas.pop(file_path, None)
+
+    def update(self, paths):
+        """
+        Bring the index up to date after the given paths were created, changed or removed
+
+        @param paths: Changed paths
+        @type paths: set|list
+        """
+        for file_path in sorted(path(p).abspath() for p in paths):
+            if file_path != self.source_dir and not file_path.startswith(self.source_dir + os.sep):
+                continue
+
+            self.drop(file_path)
+            parent = self.entries.get(file_path.parent)
+            if parent and file_path.name in parent.names:
+                parent.names.remove(file_path.name)
+            if parent and file_path.exists():
+                self.add(parent, file_path.name)
+            elif file_path == self.source_dir and file_path.isdir():
+                self.scan(file_path, os.stat(file_path))
+
+            # A changed _index.yml changes its directory's metadata
+            self.metas.pop(file_path.parent, None)
+
+        self.globs = dict()
+        for table in self.path_tables.values():
+            table.update(paths)
+
+    def stat(self, file_path):
+        """
+        Stat info for a path
+
+        @param file_path: Absolute path
+        @type file_path: path
+        @return: Result of os.stat, or None if there's nothing there
+        """
+        entry = self.entries.get(file_path)
+        return entry.stat if entry else None
+
+    def files(self, dir_path):
+        """
+        Files directly inside a directory
+
+        @param dir_path: Absolute directory path
+        @type dir_path: path
+        @return: File paths
+        @rtype: list
+        """
+        entry = self.entries.get(dir_path)
+        if not entry or not entry.is_dir:
+            return []
+        return [dir_path.joinpath(name) for name in entry.names if not self.entries[dir_path.joinpath(name)].is_dir]
+
+    def dirs(self, dir_path):
+        """
+        Directories directly inside a directory
+
+        @param dir_path: Absolute directory path
+        @type dir_path: path
+        @return: Directory paths
+        @rtype: list
+        """
+        entry = self.entries.get(dir_path)
+        if not entry or not entry.is_dir:
+            return []
+        return [dir_path.joinpath(name) for name in entry.names if self.entries[dir_path.joinpath(name)].is_dir]
+
+    def meta(self, dir_path):
+        """
+        Metadata for a directory, from its _index.yml
+
+        @param dir_path: Absolute directory path
+        @type dir_path: path
+        @return: Metadata
+        @rtype: dict
+        """
+        if dir_path not in self.metas:
+            yaml_path = dir_path.joinpath('_index.yml')
+            meta = dict()
+            if yaml_path in self.entries:
+                log.debug("Found an _index.yml in %s" % yaml_path)
+                meta = yaml.load(open(yaml_path, 'r'), yaml.Loader) or dict()
+            self.metas[dir_path] = meta
+        return self.metas[dir_path]
+
+    def glob(self, pattern):
+        """
+        Source paths matching a glob pattern, relative to the source directory. Behaves like glob.glob, but matches
+        against the index instead of the filesystem.
+
+        @param pattern: Pattern in glob format
+        @type pattern: basestring
+        @return: Matching absolute paths
+        @rtype: list
+        """
+        if pattern in self.globs:
+            return self.globs[pattern]
+
+        segments = [s for s in pattern.split('/') if s]
+        if pattern.startswith('/') or '..' in segments:
+            # Reaches outside the source tree, so the index can't answer it
+            return self.source_dir.glob(pattern)
+
+        if pattern not in self.patterns:
+            self.patterns[pattern] = [(s, re.compile(fnmatch.translate(s)) if glob.has_magic(s) else None)
+                                      for s in segments]
+
+        matches = [self.source_dir]
+        for (segment, regex) in self.patterns[pattern]:
+            found = []
+            for dir_path in matches:
+                entry = self.entries.get(dir_path)
+                if not entry or not entry.is_dir:
+                    continue
+                if regex is None:
+                    if segment in entry.names:
+                        found.append(dir_path.joinpath(segment))
+                    continue
+                for name in entry.names:
+                    # Like glob, wildcards don't match hidden files
+                    if name.startswith('.') and not segment.startswith('.'):
+                        continue
+                    if regex.match(name):
+                        found.append(dir_path.joinpath(name))
+            matches = found
+
+        self.globs[pattern] = matches
+        return matches
+
 
 class NoHandlerFoundError(Exception):
     """
@@ -137,20 +579,764 @@ class NoHandlerFoundError(Exception):
     pass
 
 
+class BuildCycleError(Exception):
+    """
+    Exception to be raised when the build loops back on itself, such as a template grabbing a file that grabs it
+    """
+    pass
+
+
+class RenderBudgetExceededError(Exception):
+    """
+    Exception to be raised when building a single output renders more files than the render budget allows
+    """
+    pass
+
+
+class Profiler(object):
+    """
+    Wall and CPU time spent per source file, handler, type handler, path mapper and template global. Times are
+    inclusive, so the time for a Markdown file includes rendering the template it goes through.
+    """
+    enabled = False
+    categories = ['file', 'handler', 'type', 'mapper', 'global']
+
+    def __init__(self, enabled=False):
+        """
+        Initialise Profiler
+
+        @param enabled: Record anything at all? A disabled profiler costs next to nothing.
+        @type enabled: bool
+        """
+        self.enabled = enabled
+        self.timings = dict()
+        self.events = []
+
+    def __enter__(self):
+        """
+        A disabled profiler stands in as its own do-nothing context manager
+        """
+        pass
+
+    def __exit__(self, *exc_info):
+        """
+        A disabled profiler stands in as its own do-nothing context manager
+        """
+        return False
+
+    def measure(self, *keys):
+        """
+        Context manager timing a block against one or more (category, name) keys
+
+        @param keys: (category, name) pairs
+        @type keys: tuple
+        """
+        if not self.enabled:
+            return self
+        return self.timer(keys)
+
+    @contextlib.contextmanager
+    def timer(self, keys):
+        """
+        Time a block, see measure
+
+        @param keys: (category, name) pairs
+        @type keys: tuple
+        """
+        wall = time.time()
+        cpu = time.clock()
+        try:
+            yield
+        finally:
+            (wall_spent, cpu_spent) = (time.time() - wall, time.clock() - cpu)
+            for (category, name) in keys:
+                self.add(category, name, 1, wall_spent, cpu_spent)
+                self.events.append(dict(name=str(name), cat=category, ph='X', ts=int(wall * 1000000),
+                                        dur=int(wall_spent * 1000000), pid=os.getpid(),
+                                        tid=threading.current_thread().ident))
+
+    def wrap(self, category, name, func):
+        """
+        Wrap a function so every call to it is timed
+
+        @param category: Category to file the calls under
+        @type category: str
+        @param name: Name to file the calls under
+        @type name: str
+        @param func: Function
+        @type func: callable
+        @return: Timed function, or the function itself when disabled
+        @rtype: callable
+        """
+        if not self.enabled:
+            return func
+
+        def timed(*args, **kwargs):
+            with self.measure((category, name)):
+                return func(*args, **kwargs)
+        return timed
+
+    def add(self, category, name, calls, wall, cpu):
+        """
+        Add time spent to the totals
+
+        @param category: Category
+        @type category: str
+        @param name: Name within the category
+        @type name: str
+        @param calls: Number of calls
+        @type calls: int
+        @param wall: Wall clock seconds
+        @type wall: float
+        @param cpu: CPU seconds
+        @type cpu: float
+        """
+        totals = self.timings.setdefault(category, dict()).setdefault(str(name), [0, 0.0, 0.0])
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+
+    def dump(self):
+        """
+        Take everything recorded so far, such as to send back from a worker process
+
+        @return: Timings and trace events
+        @rtype: dict
+        """
+        result = dict(timings=self.timings, events=self.events)
+        self.timings = dict()
+        self.events = []
+        return result
+
+    def merge(self, result):
+        """
+        Add in what another profiler recorded
+
+        @param result: Result of Profiler.dump
+        @type result: dict
+        """
+        for (category, names) in result['timings'].items():
+            for (name, (calls, wall, cpu)) in names.items():
+                self.add(category, name, calls, wall, cpu)
+        self.events.extend(result['events'])
+
+    def report(self, report_dir, rows=20):
+        """
+        Print the slowest entries in each category, and write out everything as profile.json and as a Chrome trace
+        in trace.json (load it in chrome://tracing)
+
+        @param report_dir: Directory to write the JSON files to
+        @type report_dir: path
+        @param rows: Most rows to print per category
+        @type rows: int
+        """
+        report_dir.makedirs_p()
+        json_path = report_dir.joinpath('profile.json')
+        trace_path = report_dir.joinpath('trace.json')
+        print "%-8s %-50s %8s %10s %10s" % ("Category", "Name", "Calls", "Wall (s)", "CPU (s)")
+        for category in self.categories:
+            totals = sorted(self.timings.get(category, dict()).items(), key=lambda item: item[1][1], reverse=True)
+            for (name, (calls, wall, cpu)) in totals[:rows]:
+                print "%-8s %-50s %8d %10.3f %10.3f" % (category, name[-50:], calls, wall, cpu)
+            if len(totals) > rows:
+                print "%-8s ... and %d more in %s" % (category, len(totals) - rows, json_path)
+
+        json.dump(dict((category, dict((name, dict(calls=calls, wall=wall, cpu=cpu))
+                                       for (name, (calls, wall, cpu)) in names.items()))
+                       for (category, names) in self.timings.items()),
+                  open(json_path, 'w'), indent=1, sort_keys=True)
+        json.dump(dict(traceEvents=sorted(self.events, key=lambda event: event['ts'])), open(trace_path, 'w'))
+        print "Profile written to %s, trace to %s" % (json_path, trace_path)
+
+
+class BuildCache(object):
+    """
+    On-disk record of the previous build, used to skip outputs whose inputs haven't changed.
+
+    The manifest maps each output (relative to the destination) to a key made from the handler and the mapped path,
+    plus the dependency graph recorded while it was rendered: every source file, template, glob and directory listing
+    it read, along with a digest of what was read. An output is only rebuilt if its key changed or one of those
+    digests no longer matches. Content hashes are remembered against size and mtime so unchanged sources don't need to
+    be re-read on the next build.
+
+    The manifest also keeps facts worked out from source files, such as document summaries, along with the
+    dependencies recorded while working them out, so they only need working out again when one of those changes.
+    """
+    manifest_name = 'manifest.json'
+    version = 2
+
+    env = None
+    cache_dir = None
+    full = False
+    explain = False
+    changed = None
+
+    def __init__(self, env, cache_dir, full=False, explain=False):
+        """
+        Load the manifest from the previous build, if there is one
+
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param cache_dir: Directory to keep the cache in
+        @type cache_dir: str|unicode
+        @param full: Ignore the previous build and rebuild everything
+        @type full: bool
+        @param explain: Print why each output is rebuilt
+        @type explain: bool
+        """
+        self.env = env
+        self.cache_dir = path(cache_dir).abspath()
+        self.full = full
+        self.explain = explain
+        self.previous = dict()
+        self.outputs = dict()
+        self.stats = dict()
+        self.digests = dict()
+        self.recording = []
+        self.reasons = dict()
+        self.rebuilt = set()
+        self.skipped = set()
+        self.facts = dict()
+        self.learned = []
+        self.load()
+
+    def load(self):
+        """
+        Read the manifest left by the previous build. A missing or unreadable manifest means a full build.
+        """
+        manifest_path = self.cache_dir.joinpath(self.manifest_name)
+        if not manifest_path.exists():
+            log.debug("No build cache found at %s" % manifest_path)
+            self.full = True
+            return
+
+        try:
+            manifest = json.load(open(manifest_path, 'r'))
+        except ValueError:
+            log.warn("Build cache at %s is unreadable, doing a full build" % manifest_path)
+            self.full = True
+            return
+
+        if manifest.get('version') != self.version:
+            log.debug("Build cache version changed, doing a full build")
+            self.full = True
+            return
+
+        self.previous = manifest.get('outputs', dict())
+        self.stats = manifest.get('files', dict())
+        if not self.full:
+            self.facts = manifest.get('facts', dict())
+
+    def save(self):
+        """
+        Remove outputs that the previous build produced but this one didn't, then write out the manifest
+        """
+        produced = set()
+        for entry in self.outputs.values():
+            produced.update(entry['files'])
+
+        for entry in self.previous.values():
+            for rel in entry['files']:
+                if rel not in produced and self.env.dest_dir.joinpath(rel).isfile():
+                    log.debug("Removing orphaned output %s" % rel)
+                    self.env.dest_dir.joinpath(rel).remove()
+
+        if not self.cache_dir.isdir():
+            self.cache_dir.makedirs()
+
+        for (kind, known) in self.facts.items():
+            self.facts[kind] = dict((rel, entry) for (rel, entry) in known.items()
+                                    if self.env.sources.stat(self.env.source_dir.joinpath(rel)) is not None)
+
+        manifest = dict(version=self.version, outputs=self.outputs, files=self.stats, facts=self.facts)
+        json.dump(manifest, open(self.cache_dir.joinpath(self.manifest_name), 'w'))
+
+    def hash_file(self, file_path):
+        """
+        Content hash of a source file
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        @return: Hex digest, or None if there's no such file
+        @rtype: str|None
+        """
+        rel = str(self.env.source_dir.relpathto(file_path))
+        if self.changed is not None and file_path not in self.changed and rel in self.stats:
+            # We've been told exactly what changed, and this wasn't it
+            return self.stats[rel][2]
+
+        if file_path.startswith(self.env.source_dir):
+            # The index has seen every source file, so a miss means there's nothing there
+            st = self.env.sources.stat(file_path)
+            if st is None or stat.S_ISDIR(st.st_mode):
+                return None
+        elif file_path.isfile():
+            st = file_path.stat()
+        else:
+            return None
+
+        known = self.stats.get(rel)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime:
+            return known[2]
+
+        digest = hashlib.sha1(open(file_path, 'rb').read()).hexdigest()
+        self.stats[rel] = [st.st_size, st.st_mtime, digest]
+        return digest
+
+    def recall(self, kind, file_path):
+        """
+        Facts worked out from a source file by this build or a previous one, as long as nothing they were worked out
+        from has changed since
+
+        @param kind: What sort of facts, such as 'summary'
+        @type kind: str
+        @param file_path: Absolute source path
+        @type file_path: path
+        @return: The facts and the dependencies they were worked out from, or None if they need working out
+        @rtype: tuple|None
+        """
+        known = self.facts.get(kind, dict()).get(str(self.env.source_dir.relpathto(file_path)))
+        if not known:
+            return None
+
+        (deps, facts) = known
+        for (dep, value) in deps.items():
+            if self.digest(dep) != value:
+                return None
+        return (facts, deps)
+
+    def remember(self, kind, file_path, facts, deps):
+        """
+        Keep facts worked out from a source file, for as long as nothing they were worked out from changes
+
+        @param kind: What sort of facts, such as 'summary'
+        @type kind: str
+        @param file_path: Absolute source path
+        @type file_path: path
+        @param facts: Anything that can be stored as JSON
+        @type facts: dict
+        @param deps: Dependencies recorded while working them out
+        @type deps: dict
+        """
+        rel = str(self.env.source_dir.relpathto(file_path))
+        entry = [deps, facts]
+        self.facts.setdefault(kind, dict())[rel] = entry
+        self.learned.append((kind, rel, entry))
+
+    def digest(self, dep):
+        """
+        Current digest of a dependency. Dependencies are strings of the form kind:target, where kind is one of
+
+         * file - content of a source-relative file (None if it doesn't exist)
+         * glob - the list of source paths matching a pattern
+         * dir - the names of the files directly inside a source-relative directory
+
+        @param dep: Dependency
+        @type dep: str|unicode
+        @return: Hex digest, or None
+        @rtype: str|None
+        """
+        if dep in self.digests:
+            return self.digests[dep]
+
+        (kind, target) = dep.split(':', 1)
+        if kind == 'file':
+            value = self.hash_file(self.env.source_dir.joinpath(target).abspath())
+        elif kind == 'glob':
+            matches = sorted(str(self.env.source_dir.relpathto(p)) for p in self.env.sources.glob(target))
+            value = hashlib.sha1("\n".join(matches)).hexdigest()
+        elif kind == 'dir':
+            dir_path = self.env.source_dir.joinpath(target)
+            names = sorted(str(p.name) for p in self.env.sources.files(dir_path.abspath()))
+            value = hashlib.sha1("\n".join(names)).hexdigest()
+        else:
+            raise ValueError("Unknown dependency kind %s" % kind)
+
+        self.digests[dep] = value
+        return value
+
+    def depend(self, kind, target):
+        """
+        Note that the output currently being written depends on target
+
+        @param kind: file, glob or dir
+        @type kind: str
+        @param target: Source path, or glob pattern
+        @type target: path|str|unicode
+        """
+        if not self.recording:
+            return
+
+        if kind in ('file', 'dir'):
+            target = self.env.source_dir.relpathto(path(target).abspath())
+        dep = "%s:%s" % (kind, target)
+        self.recording[-1][dep] = self.digest(dep)
+
+    def begin(self):
+        """
+        Start recording the dependencies of an output
+        """
+        self.recording.append(dict())
+
+    def end(self):
+        """
+        Stop recording the dependencies of an output
+
+        @return: Dependencies and their digests
+        @rtype: dict
+        """
+        return self.recording.pop()
+
+    def key(self, f, dest_path):
+        """
+        Build the key for writing a file to a destination
+
+        @param f: File about to be written
+        @type f: BaseFile
+        @param dest_path: Destination path
+        @type dest_path: path
+        @return: Hex digest
+        @rtype: str
+        """
+        digest = hashlib.sha1()
+        digest.update(f.handler.__class__.__name__)
+        digest.update(str(self.env.map(f.file_path)))
+        digest.update(str(self.env.dest_dir.relpathto(dest_path)))
+        return digest.hexdigest()
+
+    def stale(self, dest_path, key):
+        """
+        Work out why the output from the previous build can't be reused
+
+        @param dest_path: Destination path
+        @type dest_path: path
+        @param key: Key for this build
+        @type key: str
+        @return: Reasons to rebuild, empty if the output is still good
+        @rtype: list
+        """
+        if self.full:
+            return ['full build']
+
+        entry = self.previous.get(str(self.env.dest_dir.relpathto(dest_path)))
+        if not entry:
+            return ['new output']
+        if entry['key'] != key:
+            return ['handler or path mapping changed']
+
+        for rel in entry['files']:
+            if not self.env.dest_dir.joinpath(rel).exists():
+                return ['output %s is missing' % rel]
+
+        return ["%s changed" % dep for (dep, value) in sorted(entry['deps'].items()) if self.digest(dep) != value]
+
+    def keep(self, dest_path):
+        """
+        Carry the previous build's output forward unchanged
+
+        @param dest_path: Destination path
+        @type dest_path: path
+        """
+        rel = str(self.env.dest_dir.relpathto(dest_path))
+        self.outputs[rel] = self.previous[rel]
+        self.skipped.add(rel)
+
+    def record(self, dest_path, key, f, deps):
+        """
+        Record a freshly written output
+
+        @param dest_path: Destination path
+        @type dest_path: path
+        @param key: Key the output was built with
+        @type key: str
+        @param f: File that was written
+        @type f: BaseFile
+        @param deps: Dependencies recorded while writing
+        @type deps: dict
+        """
+        rel = str(self.env.dest_dir.relpathto(dest_path))
+        self.outputs[rel] = dict(
+            key=key,
+            source=str(self.env.source_dir.relpathto(f.file_path)),
+            handler=f.handler.__class__.__name__,
+            files=[str(self.env.dest_dir.relpathto(p)) for p in f.output_paths(dest_path)],
+            deps=deps
+        )
+        self.rebuilt.add(rel)
+
+    def merge(self, result):
+        """
+        Take on what a worker process recorded for an output in a parallel build
+
+        @param result: Output, its manifest entry, whether it was rebuilt and why, and the source stats it learned
+        @type result: dict
+        """
+        rel = result['rel']
+        self.outputs[rel] = result['entry']
+        self.stats.update(result['stats'])
+        for (kind, file_rel, entry) in result['facts']:
+            self.facts.setdefault(kind, dict())[file_rel] = entry
+        if result['rebuilt']:
+            self.rebuilt.add(rel)
+            self.reasons[rel] = result['reasons']
+            if self.explain:
+                print "Rebuilding %s: %s" % (rel, ", ".join(result['reasons']))
+        else:
+            self.skipped.add(rel)
+
+
+class BuildNode(object):
+    """
+    A single step in the build plan
+    """
+    env = None
+    name = None
+
+    def __init__(self, env, name, requires=None):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param name: Unique name of the node within the plan
+        @type name: str
+        @param requires: Nodes that have to run before this one
+        @type requires: list|None
+        """
+        self.env = env
+        self.name = name
+        self.requires = list(requires or [])
+
+    def run(self):
+        """
+        Do the work for this node
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+
+class SourceNode(BuildNode):
+    """
+    Load a source file through its handler
+    """
+    file_path = None
+    file = None
+
+    def __init__(self, env, file_path):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param file_path: Source file
+        @type file_path: path
+        """
+        super(SourceNode, self).__init__(env, "source:%s" % env.source_dir.relpathto(file_path))
+        self.file_path = file_path
+
+    def run(self):
+        self.file = self.env.get(self.file_path)
+
+
+class TypeNode(BuildNode):
+    """
+    Process a directory type, so that everything written from that directory can use the result
+    """
+    dir_path = None
+
+    def __init__(self, env, dir_path):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param dir_path: Directory
+        @type dir_path: path
+        """
+        super(TypeNode, self).__init__(env, "type:%s" % env.source_dir.relpathto(dir_path))
+        self.dir_path = dir_path
+
+    def run(self):
+        self.env.dispatch_type(self.dir_path)
+
+
+class OutputNode(BuildNode):
+    """
+    Write a loaded source file out to the destination
+    """
+    source = None
+    dest_path = None
+
+    def __init__(self, env, source, dest_path, requires=None, extra_deps=None, **kwargs):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param source: Node loading the file to write
+        @type source: SourceNode
+        @param dest_path: Destination path
+        @type dest_path: path
+        @param requires: Other nodes that have to run first
+        @type requires: list|None
+        @param extra_deps: Source paths the output depends on beyond the file itself
+        @type extra_deps: list|None
+        @param kwargs: Passed on to the file's write_to
+        """
+        super(OutputNode, self).__init__(env, "output:%s" % env.dest_dir.relpathto(dest_path),
+                                         requires=[source] + list(requires or []))
+        self.source = source
+        self.dest_path = dest_path
+        self.extra_deps = extra_deps
+        self.kwargs = kwargs
+
+    def run(self):
+        self.env.write(self.source.file, self.dest_path, extra_deps=self.extra_deps, **self.kwargs)
+
+
+class BlogPageNode(OutputNode):
+    """
+    Write one page of a paginated blog index. The posts on the page keep their HTML while the page renders, and let
+    go of it once the page is written.
+    """
+
+    def run(self):
+        posts = self.kwargs['posts']
+        for post in posts:
+            post.retain = True
+        try:
+            super(BlogPageNode, self).run()
+        finally:
+            for post in posts:
+                post.release()
+
+
+class BuildPlan(object):
+    """
+    The build as a graph of source, type and output nodes, run in dependency order.
+
+    Building is two-phase: the types scan the source tree and add nodes to the plan without rendering anything, then
+    the plan runs each node once all the nodes it requires have run.
+    """
+    env = None
+
+    def __init__(self, env):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        """
+        self.env = env
+        self.nodes = []
+        self.by_name = dict()
+        self.done = set()
+
+    def add(self, node):
+        """
+        Add a node to the plan. A node with the same name already in the plan wins.
+
+        @param node: Node to add
+        @type node: BuildNode
+        @return: The node in the plan
+        @rtype: BuildNode
+        """
+        if node.name in self.by_name:
+            return self.by_name[node.name]
+
+        self.nodes.append(node)
+        self.by_name[node.name] = node
+        return node
+
+    def order(self):
+        """
+        Sort the nodes so that every node comes after the nodes it requires, keeping the order they were added in
+        where there's a choice.
+
+        @return: Nodes in the order to run them
+        @rtype: list
+        """
+        position = dict((node.name, i) for (i, node) in enumerate(self.nodes))
+        waiting = dict((node.name, 0) for node in self.nodes)
+        dependants = dict((node.name, []) for node in self.nodes)
+        for node in self.nodes:
+            for required in node.requires:
+                waiting[node.name] += 1
+                dependants[required.name].append(node)
+
+        ready = [position[name] for (name, count) in waiting.items() if count == 0]
+        heapq.heapify(ready)
+        ordered = []
+        while ready:
+            node = self.nodes[heapq.heappop(ready)]
+            ordered.append(node)
+            for dependant in dependants[node.name]:
+                waiting[dependant.name] -= 1
+                if not waiting[dependant.name]:
+                    heapq.heappush(ready, position[dependant.name])
+
+        if len(ordered) != len(self.nodes):
+            raise BuildCycleError(" -> ".join(self.find_cycle([n for n in self.nodes if waiting[n.name]])))
+
+        return ordered
+
+    def find_cycle(self, nodes):
+        """
+        Walk requirements from the given unfinished nodes until one repeats
+
+        @param nodes: Nodes that couldn't be ordered
+        @type nodes: list
+        @return: Names of the nodes making up a cycle
+        @rtype: list
+        """
+        stuck = set(node.name for node in nodes)
+        trail = [nodes[0]]
+        while True:
+            node = [n for n in trail[-1].requires if n.name in stuck][0]
+            if node in trail:
+                return [n.name for n in trail[trail.index(node):]] + [node.name]
+            trail.append(node)
+
+    def run(self, node):
+        """
+        Run a node, after first running anything it requires that hasn't run yet
+
+        @param node: Node to run
+        @type node: BuildNode
+        """
+        if node.name in self.done:
+            return
+
+        for required in node.requires:
+            self.run(required)
+
+        log.debug("Running %r" % node)
+        self.env.renders = 0
+        node.run()
+        self.done.add(node.name)
+
+    def execute(self):
+        """
+        Run every node in dependency order
+        """
+        for node in self.order():
+            self.run(node)
+
+
 class Builder(object):
     """
     Manages the total build and relevant parameters
     """
     env = None
+    options = None
 
-    def __init__(self, source_dir, dest_dir):
+    def __init__(self, source_dir, dest_dir, cache_dir=None, full=False, explain=False, sources=None):
         """
         Initialise Builder
         @param source_dir:str Source directory
         @param dest_dir:str Destination directory
+        @param cache_dir:str Build cache directory, or None to always build everything
+        @param full:bool Ignore the build cache and rebuild everything
+        @param explain:bool Print why each output is rebuilt
+        @param sources:SourceIndex Index of the source directory, if one is already up to date
         """
         log.debug("Creating Builder from %s to %s" % (source_dir, dest_dir))
-        self.env = BuildEnvironment(source_dir=source_dir, dest_dir=dest_dir)
+        self.env = BuildEnvironment(source_dir=source_dir, dest_dir=dest_dir, sources=sources)
+        if cache_dir:
+            self.env.cache = BuildCache(self.env, cache_dir, full=full, explain=explain)
+            self.env.markdown = MarkdownCache(MARKDOWN_EXTRAS, cache_dir=path(cache_dir).joinpath('markdown'))
 
     def register(self, handler):
         """
@@ -179,6 +1365,46 @@ class Builder(object):
         """
         self.env.register_type(type_handler)
 
+    def build_parallel(self, plan, jobs):
+        """
+        Spread the outputs of the plan across a pool of worker processes. Each worker sets up its own builder and
+        plan, and processes any types its outputs need for itself, so the outputs are the same as a serial build.
+
+        @param plan: Build plan
+        @type plan: BuildPlan
+        @param jobs: Number of worker processes
+        @type jobs: int
+        """
+        names = [node.name for node in plan.order() if isinstance(node, OutputNode)]
+        chunk_size = max(1, len(names) // (jobs * 4))
+        log.debug("Building %d outputs across %d processes" % (len(names), jobs))
+
+        pool = multiprocessing.Pool(jobs, init_worker, (self.options,))
+        try:
+            for result in pool.imap(build_output, names, chunk_size):
+                self.env.writer.produced.update(result['produced'])
+                self.env.markdown.written += result['markdown_written']
+                if result['profile']:
+                    self.env.profiler.merge(result['profile'])
+                if self.env.cache:
+                    self.env.cache.merge(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    def precompile(self):
+        """
+        Compile everything that can be compiled ahead of time into the build cache, without building
+
+        @return: Number of files compiled
+        @rtype: int
+        """
+        count = 0
+        for handler in self.env.handlers:
+            if hasattr(handler, 'precompile'):
+                count += handler.precompile()
+        return count
+
     def clean(self):
         """
         Clean out the destination directory
@@ -192,13 +1418,83 @@ class Builder(object):
             else:
                 p.remove()
 
-    def build(self):
+    def sweep(self):
+        """
+        Remove everything in the destination directory that this build didn't produce. Unlike clean, outputs that are
+        still wanted are never touched, so their mtimes survive a full build.
+        """
+        produced = self.env.writer.produced
+        for file_path in self.env.dest_dir.walkfiles():
+            if str(self.env.dest_dir.relpathto(file_path)) not in produced:
+                log.debug("Removing %s, the build didn't produce it" % file_path)
+                file_path.remove()
+
+        for dir_path in sorted(self.env.dest_dir.walkdirs(), reverse=True):
+            if not dir_path.listdir():
+                dir_path.rmdir()
+
+    def plan(self):
+        """
+        Scan the source tree into a build plan, without rendering anything
+
+        @return: Build plan
+        @rtype: BuildPlan
+        """
+        log.debug("Planning build")
+        plan = BuildPlan(self.env)
+        root = self.env.load_type(self.env.source_dir)
+        if root is not None:
+            root.plan(plan)
+
+        if self.env.cache:
+            # Pages that used a directory type last time are likely to again, so let the type go first
+            for node in plan.nodes:
+                if not isinstance(node, OutputNode):
+                    continue
+                entry = self.env.cache.previous.get(str(self.env.dest_dir.relpathto(node.dest_path)))
+                for dep in (entry or dict()).get('deps', dict()):
+                    (kind, target) = dep.split(':', 1)
+                    type_node = plan.by_name.get("type:%s" % target)
+                    if kind == 'dir' and type_node and type_node not in node.requires:
+                        node.requires.append(type_node)
+
+        return plan
+
+    def build(self, jobs=1, deploy_dir=None):
         """
         Build from source to destination
+
+        @param jobs: Number of processes to render with. Parallel builds need a builder from create_builder.
+        @type jobs: int
+        @param deploy_dir: Where to write a deploy manifest of the outputs and what changed, or None for no manifest
+        @type deploy_dir: str|unicode|None
         """
 
         log.debug("Initiating build")
-        self.env.dispatch_type(self.env.source_dir)
+        plan = self.plan()
+        if jobs > 1 and self.options:
+            self.build_parallel(plan, jobs)
+        else:
+            plan.execute()
+            self.env.finish()
+        log.debug("Parsed HTML cache: %d hits, %d misses" % (self.env.dom_cache.hits, self.env.dom_cache.misses))
+        log.debug("Markdown cache: %d hits, %d from disk, %d converted" %
+                  (self.env.markdown.memory.hits, self.env.markdown.disk_hits,
+                   self.env.markdown.memory.misses - self.env.markdown.disk_hits))
+        self.env.markdown.trim()
+        log.debug("Static files: %(copied)d copied, %(linked)d linked, %(unchanged)d already published" %
+                  self.env.publisher.counts)
+        log.debug("Rendered outputs: %(written)d written, %(unchanged)d unchanged" % self.env.writer.counts)
+
+        if self.env.cache:
+            self.env.cache.save()
+
+        if deploy_dir:
+            manifest = DeployManifest(self.env, deploy_dir)
+            manifest.collect()
+            diff = manifest.save()
+            print "Deploy manifest: %d added, %d changed, %d removed" % (len(diff['added']), len(diff['changed']),
+                                                                         len(diff['removed']))
 
 
 class BuildEnvironment(object):
@@ -212,21 +1508,45 @@ class BuildEnvironment(object):
     jinja2_env = None
     type_handlers = None
     type_map = None
+    cache = None
+    sources = None
+    render_budget = None
+    image_cache_bytes = None
+    dom_cache = None
+    markdown = None
+    publisher = None
+    writer = None
+    paths = None
+    profiler = None
 
-    def __init__(self, source_dir, dest_dir):
+    def __init__(self, source_dir, dest_dir, sources=None):
         """
         Initialise Build environment
         @param source_dir: Source directory
         @type source_dir: path
         @param dest_dir: Destination directory
         @type dest_dir: path
+        @param sources: Index of the source directory, if one is already up to date
+        @type sources: SourceIndex|None
         """
         self.source_dir = path(source_dir).abspath()
         self.dest_dir = path(dest_dir).abspath()
+        self.sources = sources or SourceIndex(self.source_dir)
         self.handlers = []
         self.mappers = []
         self.type_handlers = []
         self.type_map = dict()
+        self.dom_cache = LRUCache(512)
+        self.html_cache = LRUCache(256)
+        self.files = dict()
+        self.dispatch = dict()
+        self.markdown = MarkdownCache(MARKDOWN_EXTRAS)
+        self.publisher = Publisher(self)
+        self.writer = OutputWriter(self)
+        self.profiler = Profiler()
+        self.summaries = dict()
+        self.active = []
+        self.renders = 0
 
     def register(self, handler):
         """
@@ -237,6 +1557,7 @@ class BuildEnvironment(object):
 
         log.debug("Registering handler %r" % handler)
         self.handlers.append(handler(self))
+        self.dispatch = dict()
 
     def register_map(self, mapper):
         """
@@ -247,6 +1568,7 @@ class BuildEnvironment(object):
         """
         log.debug("Registering path mapper %r" % mapper)
         self.mappers.append(mapper(self))
+        self.paths = None
 
     def register_type(self, type_handler):
         """
@@ -258,64 +1580,349 @@ class BuildEnvironment(object):
         log.debug("Registering type handler %r" % type_handler)
         self.type_handlers.append(type_handler(self))
 
-    def dispatch_type(self, full_path):
+    def load_type(self, full_path):
         """
-        Call handler for any given dir
+        Load the handler for any given dir, without processing it. Each directory is only loaded once per build.
 
         @param full_path: Path to directory
         @type full_path: path
+        @return: Type, or None if no type handler takes the directory
+        @rtype: BaseType|None
         """
-        meta = dict()
-        yaml_path = full_path.joinpath('_index.yml')
+        full_path = path(full_path).abspath()
+        if full_path in self.type_map:
+            return self.type_map[full_path]
 
-        if yaml_path.exists():
-            log.debug("Found an _index.yml in %s" % yaml_path)
-            meta = yaml.load(open(yaml_path, 'r'), yaml.Loader)
+        meta = self.sources.meta(full_path)
 
         for t in self.type_handlers:
             if t.match(full_path, meta):
                 self.type_map[full_path] = t.load(full_path, meta)
                 log.debug("Registered type %r for path %s" % (self.type_map[full_path], full_path))
-                self.type_map[full_path].process()
                 return self.type_map[full_path]
 
+        log.warn("No type handler for %s (type %s), skipping it" % (full_path, meta.get('type')))
+        self.type_map[full_path] = None
+        return None
+
+    def dispatch_type(self, full_path):
+        """
+        Process the type for any given dir. Each directory is only processed once per build, later calls (such as
+        from templates listing blog posts) get the already processed type back.
+
+        @param full_path: Path to directory
+        @type full_path: path
+        @return: Processed type, or None if no type handler takes the directory
+        @rtype: BaseType|None
+        """
+        type_ = self.load_type(full_path)
+        if type_ is None:
+            return None
+        if type_.processed:
+            log.debug("Type for path %s already processed" % type_.dir_path)
+            self.depend_all(type_.deps)
+            return type_
+
+        # Whatever the type reads while processing is a dependency of anything that uses it later
+        if self.cache:
+            self.cache.begin()
+        try:
+            self.depend('file', type_.dir_path.joinpath('_index.yml'))
+            self.depend('dir', type_.dir_path)
+            with self.rendering("%s/" % self.source_dir.relpathto(type_.dir_path)):
+                with self.profiler.measure(('type', type_.handler.__class__.__name__)):
+                    type_.process()
+        finally:
+            if self.cache:
+                type_.deps = self.cache.end()
+        type_.processed = True
+
+        self.depend_all(type_.deps)
+        return type_
+
+    @contextlib.contextmanager
+    def rendering(self, name):
+        """
+        Guard a render of a source file or processing of a type, catching loops (a template grabbing a file that
+        grabs it back) and runaway renders before they hang the build.
+
+        @param name: Source-relative name of what's being rendered
+        @type name: str|unicode
+        """
+        name = str(name)
+        if name in self.active:
+            raise BuildCycleError(" -> ".join(self.active[self.active.index(name):] + [name]))
+
+        self.renders += 1
+        if self.render_budget and self.renders > self.render_budget:
+            raise RenderBudgetExceededError("More than %d renders while building %s" %
+                                            (self.render_budget, self.active[0] if self.active else name))
+
+        self.active.append(name)
+        try:
+            yield
+        finally:
+            self.active.pop()
+
+    def summary(self, file_path):
+        """
+        Look up the summary of a source document, converting it only if neither this build nor the build cache has
+        seen it yet. See summarise for what's in it.
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        @return: Summary
+        @rtype: dict
+        """
+        rel = str(self.source_dir.relpathto(file_path))
+        if rel in self.summaries and self.summaries[rel] is None:
+            # Still being converted, it's asking for its own summary somewhere along the way
+            raise BuildCycleError(" -> ".join(self.active + ["summary(%s)" % rel]))
+
+        if not self.summaries.get(rel) and self.cache:
+            known = self.cache.recall('summary', file_path)
+            if known:
+                self.summaries[rel] = known
+
+        if not self.summaries.get(rel):
+            self.summarise(file_path, self.get(file_path).as_html)
+
+        (summary, deps) = self.summaries[rel]
+        self.depend_all(deps)
+        return summary
+
+    def summarise(self, file_path, convert):
+        """
+        Convert a document to HTML, filling in its summary on the way if it hasn't got one yet this build. The
+        summary holds the title (the first h1), lead (the paragraph after it), excerpt (the first paragraph), headings,
+        outbound links, word count and mapped URL. It's kept along with whatever the conversion depended on.
+
+        The HTML of recently converted documents is kept too, so grabbing the same document again doesn't convert it
+        again; what the conversion depended on is still recorded against whatever asked for it.
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        @param convert: Converts the document to HTML
+        @type convert: callable
+        @return: HTML
+        @rtype: str|unicode
+        """
+        rel = str(self.source_dir.relpathto(file_path))
+        known = self.summaries.get(rel, False)
+        if known is None:
+            # Converting came back round to here for the same document, which should just convert
+            return convert()
+
+        html = self.html_cache.get(rel)
+        if html is not None:
+            self.depend_all(known[1])
+            return html
+
+        if not known:
+            self.summaries[rel] = None
+        if self.cache:
+            self.cache.begin()
+        try:
+            self.depend('file', file_path)
+            html = convert()
+        except:
+            if not known:
+                del self.summaries[rel]
+            raise
+        finally:
+            deps = self.cache.end() if self.cache else dict()
+        self.depend_all(deps)
+
+        if known:
+            # Summarised by an earlier build, only the HTML was missing
+            self.summaries[rel] = (known[0], deps)
+            self.html_cache.put(rel, html)
+            return html
+
+        summary = dict(title=u'', lead=u'', excerpt=u'', headings=[], links=[], word_count=0,
+                       url=str(self.map(file_path)))
+        if html.strip():
+            document = pq(html)
+            summary['title'] = document('h1').eq(0).text() or u''
+            summary['lead'] = document('h1 + p').eq(0).text() or u''
+            summary['excerpt'] = document('p').eq(0).text() or u''
+            summary['headings'] = [dict(level=int(e.tag[1]), text=pq(e).text(), id=e.get('id'))
+                                   for e in document('h1, h2, h3, h4, h5, h6')]
+            for e in document('a[href]'):
+                if e.get('href') not in summary['links']:
+                    summary['links'].append(e.get('href'))
+            summary['word_count'] = len(document.text().split())
+
+        self.summaries[rel] = (summary, deps)
+        self.html_cache.put(rel, html)
+        if self.cache:
+            self.cache.remember('summary', file_path, summary, deps)
+        return html
+
     def get(self, file_path):
         """
-        Retrieve a file from the given path via the matching handler.
+        Retrieve a file from the given path via the matching handler. Each path is only loaded once per build, so
+        everything that gets it shares the one file.
 
         @param file_path: Absolute path to file
         @type file_path: path
         @return: File
         @rtype: BaseFile
         """
+        self.depend('file', file_path)
+        if file_path in self.files:
+            return self.files[file_path]
+
+        handler = self.find_handler(file_path)
+        with self.profiler.measure(('handler', handler.__class__.__name__)):
+            self.files[file_path] = handler.load(file_path)
+        return self.files[file_path]
+
+    def find_handler(self, file_path):
+        """
+        Find the handler for a path. Only handlers registered for the path's extension, or for no extension in
+        particular, are asked whether they match, in the order they were registered.
 
+        @param file_path: Absolute path to file
+        @type file_path: path
+        @return: Handler
+        @rtype: BaseFileHandler
+        """
         log.debug("Looking for handler for %s" % file_path)
+        ext = file_path.ext.lower()
+        if ext not in self.dispatch:
+            self.dispatch[ext] = [handler for handler in self.handlers
+                                  if handler.extensions is None or ext in handler.extensions]
 
-        for handler in self.handlers:
+        for handler in self.dispatch[ext]:
             if handler.match(file_path):
                 log.debug("Found handler %r" % handler)
-                return handler.load(file_path)
+                return handler
 
         raise NoHandlerFoundError(file_path)
 
+    def write(self, f, dest_path, extra_deps=None, **kwargs):
+        """
+        Write the conversion of a file out to the destination, unless the build cache shows the output from the
+        previous build was made from the same inputs.
+
+        @param f: File to write
+        @type f: BaseFile
+        @param dest_path: Destination path
+        @type dest_path: path
+        @param extra_deps: Source paths the output depends on beyond the file itself, or (kind, target) pairs for
+            other kinds of dependency
+        @type extra_deps: list|None
+        """
+        if not self.cache:
+            self.convert(f, dest_path, **kwargs)
+            return
+
+        key = self.cache.key(f, dest_path)
+        reasons = self.cache.stale(dest_path, key)
+        if not reasons:
+            log.debug("Output %s is up to date" % dest_path)
+            self.cache.keep(dest_path)
+            return
+
+        self.cache.reasons[str(self.dest_dir.relpathto(dest_path))] = reasons
+        if self.cache.explain:
+            print "Rebuilding %s: %s" % (self.dest_dir.relpathto(dest_path), ", ".join(reasons))
+
+        self.cache.begin()
+        try:
+            for dep in f.dependencies() + (extra_deps or []):
+                if isinstance(dep, tuple):
+                    self.depend(*dep)
+                else:
+                    self.depend('file', dep)
+            self.convert(f, dest_path, **kwargs)
+        finally:
+            deps = self.cache.end()
+        self.cache.record(dest_path, key, f, deps)
+
+    def convert(self, f, dest_path, **kwargs):
+        """
+        Write the conversion of a file out to the destination, timed against the file and its handler
+
+        @param f: File to write
+        @type f: BaseFile
+        @param dest_path: Destination path
+        @type dest_path: path
+        """
+        with self.profiler.measure(('file', self.source_dir.relpathto(f.file_path)),
+                                   ('handler', f.handler.__class__.__name__)):
+            f.write_to(dest_path, **kwargs)
+
+    def finish(self):
+        """
+        Let every handler complete its background work, then wait for the outputs to be written
+        """
+        try:
+            for handler in self.handlers:
+                handler.finish()
+        finally:
+            self.writer.finish()
+
+    def depend(self, kind, target):
+        """
+        Record that whatever is being written right now depends on target. Does nothing without a build cache.
+
+        @param kind: file, glob or dir
+        @type kind: str
+        @param target: Source path, or glob pattern
+        @type target: path|str|unicode
+        """
+        if self.cache:
+            self.cache.depend(kind, target)
+
+    def depend_all(self, deps):
+        """
+        Record a set of previously recorded dependencies against whatever is being written right now
+
+        @param deps: Dependencies and their digests
+        @type deps: dict
+        """
+        if self.cache and self.cache.recording:
+            self.cache.recording[-1].update(deps)
+
+    def path_table(self):
+        """
+        The mapping table for the registered path mappers. It's kept with the source index, so it carries over between
+        builds in monitor mode.
+
+        @return: Path table
+        @rtype: PathTable
+        """
+        if self.paths is None:
+            key = tuple(mapper.__class__ for mapper in self.mappers)
+            if key not in self.sources.path_tables:
+                self.sources.path_tables[key] = PathTable(self)
+            self.paths = self.sources.path_tables[key]
+            self.paths.env = self
+        return self.paths
+
     def map(self, file_path):
         """
         Convert a source path to a destination path
 
-        @param file_path: Source path
+        @param file_path: Source path, absolute or relative to the source directory
         @type file_path: path
         @return Relative destination path
         @rtype str
         """
+        return self.path_table().map(self.source_dir.joinpath(file_path))
 
-        file_path = self.source_dir.relpathto(file_path)
-
-        log.debug("Looking for mapper for %s" % file_path)
+    def source_for(self, dest_rel):
+        """
+        Convert a destination path back to the source file it's mapped from
 
-        for mapper in self.mappers:
-            if mapper.match(file_path):
-                log.debug("Found mapper %r" % mapper)
-                return mapper.relative(file_path)
+        @param dest_rel: Destination path, relative to the destination directory
+        @type dest_rel: str|unicode
+        @return: Absolute source path, or None if no source file maps there
+        @rtype: path|None
+        """
+        return self.path_table().reverse.get(str(dest_rel))
 
     def to_dest(self, file_path):
         """
@@ -335,6 +1942,9 @@ class BaseFileHandler(object):
     """
     Base class for matching and loading Files
     """
+    # Lower case extensions (with the dot) this handler is asked about, or None to be asked about every file
+    extensions = None
+
     def __init__(self, env):
         """
         Init the handler with the current environment
@@ -356,6 +1966,12 @@ class BaseFileHandler(object):
         """
         raise NotImplementedError()
 
+    def finish(self):
+        """
+        Complete any work left in the background once every output has been written
+        """
+        pass
+
 
 class BaseFile(object):
     """
@@ -386,81 +2002,674 @@ class BaseFile(object):
 
         raise NotImplementedError()
 
-    def write_to(self, file_path):
+    def write_to(self, file_path):
+        """
+        Write the conversion of this file out to the given path
+
+        @param file_path: Absolute path to write conversion out to
+        @type file_path: path
+        """
+        raise NotImplementedError()
+
+    def dependencies(self):
+        """
+        Source paths the conversion of this file is built from, beyond whatever it reads while rendering
+
+        @return: Source paths
+        @rtype: list
+        """
+        return [self.file_path]
+
+    def output_paths(self, file_path):
+        """
+        Paths actually written when this file is written out to the given path
+
+        @param file_path: Path passed to write_to
+        @type file_path: path
+        @return: Written paths
+        @rtype: list
+        """
+        return [file_path]
+
+    def ensure_output_dir(self, file_path):
+        """
+        Ensure the dir for the given file path exists
+
+        @param file_path: Path of file or dir
+        @type file_path: path
+        """
+
+        # Ensure parent directory exists
+        self.env.writer.makedirs(file_path.parent)
+
+
+class AnyFileHandler(BaseFileHandler):
+    """
+    Handle any file at all, by simply copying it
+    """
+    def match(self, file_path):
+        """
+        This handler matches all files
+        """
+        return True
+    
+    def load(self, file_path):
+        """
+        Create the AnyFile from the path
+        
+        @param file_path: File to load
+        @type file_path: path
+        """
+        af = AnyFile(self.env, self)
+        af.read_from(file_path)
+        return af
+
+
+class AnyFile(BaseFile):
+    """
+    Represent any file at all by holding the original file path then copying on request.
+    """
+    def read_from(self, file_path):
+        """
+        "Read" the file from the given file_path
+
+        @param file_path: Path to file to read
+        @type file_path: path
+        """
+        self.file_path = file_path
+    
+    def write_to(self, file_path):
+        """
+        Write the file to the given file_path by publishing the read path there. This will create any directories
+        required to succeed.
+
+        @param file_path: Path to write to
+        @type file_path: path
+        """
+
+        self.ensure_output_dir(file_path)
+        self.env.publisher.publish(self.file_path, file_path)
+
+
+class OutputWriteError(Exception):
+    """
+    Exception to be raised when one or more outputs couldn't be written
+    """
+    pass
+
+
+class OutputWriter(object):
+    """
+    Puts rendered outputs into the destination. An output whose bytes haven't changed is left alone, mtime and all, so
+    rsync and CDNs only see the files that really changed. Anything else is written to a temporary file alongside and
+    renamed over the old one, so a half-written output is never visible.
+
+    Writing happens behind the build: outputs go on a bounded queue that a few writer threads take from in batches,
+    so rendering carries on while the disk catches up. Once the queue is full, rendering waits for it, which keeps
+    the memory held by unwritten outputs bounded. Directories are created once per batch and remembered. When the
+    build finishes the threads are stopped, and any writes that failed are raised together, in path order.
+
+    Keeps track of everything the build produced, so anything else in the destination can be swept away afterwards.
+    """
+    env = None
+    # Writer threads
+    threads = 4
+    # Most outputs waiting to be written before rendering has to wait
+    queue_size = 64
+    # Most outputs a writer thread takes at once
+    batch_size = 16
+
+    def __init__(self, env):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        """
+        self.env = env
+        self.produced = dict()
+        self.counts = dict(written=0, unchanged=0)
+        self.lock = threading.Lock()
+        self.queue = None
+        self.workers = []
+        self.dirs = set()
+        self.failures = dict()
+        self.errors = []
+
+    def claim(self, file_path, digest=None):
+        """
+        Note that this build produced a file, however it got there
+
+        @param file_path: Destination file
+        @type file_path: path
+        @param digest: Content hash, if it's known
+        @type digest: str|None
+        """
+        self.produced[str(self.env.dest_dir.relpathto(file_path))] = digest
+
+    def write(self, file_path, content):
+        """
+        Queue an output to be written, unless it already holds exactly this content. Unicode is written as UTF-8.
+        Waits if the queue is full.
+
+        @param file_path: Destination file
+        @type file_path: path
+        @param content: Content
+        @type content: str|unicode
+        """
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        with self.lock:
+            self.claim(file_path, hashlib.sha1(content).hexdigest())
+            if self.queue is None:
+                self.start()
+            queue = self.queue
+        queue.put((file_path, content))
+
+    def start(self):
+        """
+        Start the writer threads. They're started on the first write after the last finish, so a worker process forked
+        before then starts its own.
+        """
+        self.queue = Queue.Queue(self.queue_size)
+        self.workers = []
+        for i in range(self.threads):
+            thread = threading.Thread(target=self.run, args=(self.queue,), name="writer-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.workers.append(thread)
+
+    def run(self, queue):
+        """
+        Write outputs from the queue in batches, in a writer thread, until it takes a None off the queue
+
+        @param queue: Queue of destination paths and content
+        @type queue: Queue.Queue
+        """
+        stopping = False
+        while not stopping:
+            batch = [queue.get()]
+            try:
+                while len(batch) < self.batch_size and batch[-1] is not None:
+                    batch.append(queue.get_nowait())
+            except Queue.Empty:
+                pass
+            if batch[-1] is None:
+                stopping = True
+                queue.task_done()
+                batch.pop()
+
+            try:
+                for dir_path in set(file_path.parent for (file_path, content) in batch):
+                    self.makedirs(dir_path)
+                for (file_path, content) in batch:
+                    try:
+                        self.write_now(file_path, content)
+                    except (IOError, OSError), e:
+                        with self.lock:
+                            self.failures[str(self.env.dest_dir.relpathto(file_path))] = str(e)
+            except (IOError, OSError), e:
+                with self.lock:
+                    for (file_path, content) in batch:
+                        self.failures[str(self.env.dest_dir.relpathto(file_path))] = str(e)
+            except Exception:
+                # Anything else is a bug, which finish raises as it is. The thread carries on so the queue never
+                # stops draining, which would leave the build waiting on it forever.
+                with self.lock:
+                    self.errors.append((str(self.env.dest_dir.relpathto(batch[0][0])), sys.exc_info()))
+            finally:
+                for item in batch:
+                    queue.task_done()
+
+    def makedirs(self, dir_path):
+        """
+        Make sure a destination directory exists, only looking the first time it's asked for
+
+        @param dir_path: Destination directory
+        @type dir_path: path
+        """
+        if dir_path in self.dirs:
+            return
+        dir_path.makedirs_p()
+        with self.lock:
+            self.dirs.add(dir_path)
+
+    def write_now(self, file_path, content):
+        """
+        Write an output straight away, unless it already holds exactly this content
+
+        @param file_path: Destination file
+        @type file_path: path
+        @param content: Content
+        @type content: str
+        @return: Whether the file was written
+        @rtype: bool
+        """
+        if file_path.isfile() and file_path.getsize() == len(content) and open(file_path, 'rb').read() == content:
+            log.debug("%s is unchanged" % file_path)
+            with self.lock:
+                self.counts['unchanged'] += 1
+            return False
+
+        temp_path = file_path.parent.joinpath('.%s.%d.%d.tmp' % (file_path.name, os.getpid(),
+                                                                  threading.current_thread().ident))
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(content)
+        os.rename(temp_path, file_path)
+        with self.lock:
+            self.counts['written'] += 1
+        return True
+
+    def finish(self):
+        """
+        Wait for everything queued to be written and stop the writer threads. Raises OutputWriteError if anything
+        couldn't be written, or re-raises whatever else went wrong in a writer thread.
+        """
+        with self.lock:
+            (queue, workers) = (self.queue, self.workers)
+            (self.queue, self.workers) = (None, [])
+        if queue is not None:
+            for thread in workers:
+                queue.put(None)
+            for thread in workers:
+                thread.join()
+
+        with self.lock:
+            (failures, errors) = (self.failures, self.errors)
+            (self.failures, self.errors) = (dict(), [])
+        if errors:
+            (rel, (error_type, error, tb)) = sorted(errors, key=lambda (rel, exc_info): rel)[0]
+            raise error_type, error, tb
+        if failures:
+            raise OutputWriteError("\n".join("%s: %s" % (rel, failures[rel]) for rel in sorted(failures)))
+
+    def drain(self):
+        """
+        Take the files produced so far, such as to send back from a worker process
+
+        @return: Content hashes (or None) by destination-relative path
+        @rtype: dict
+        """
+        produced = self.produced
+        self.produced = dict()
+        return produced
+
+
+class DeployManifest(object):
+    """
+    Machine-readable record of what a build produced, for deploying it. For every output it holds the source it came
+    from, the handler and path mapper used, its size and content hash. Comparing with the previous manifest gives the
+    outputs that were added, changed and removed, written out as:
+
+     * deploy.json - the manifest itself
+     * diff.json - the added, changed and removed lists
+     * changed.txt - added and changed outputs, one per line, for rsync --files-from or an object store uploader
+     * removed.txt - removed outputs, one per line
+
+    Paths are relative to the destination directory.
+    """
+    manifest_name = 'deploy.json'
+    version = 1
+
+    env = None
+    manifest_dir = None
+
+    def __init__(self, env, manifest_dir):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param manifest_dir: Directory for the manifest and lists
+        @type manifest_dir: str|unicode
+        """
+        self.env = env
+        self.manifest_dir = path(manifest_dir).abspath()
+        self.previous = dict()
+        self.outputs = dict()
+
+        manifest_path = self.manifest_dir.joinpath(self.manifest_name)
+        if manifest_path.isfile():
+            try:
+                manifest = json.load(open(manifest_path, 'r'))
+                if manifest.get('version') == self.version:
+                    self.previous = manifest['outputs']
+            except ValueError:
+                log.warn("Deploy manifest at %s is unreadable, treating every output as added" % manifest_path)
+
+    def mapper_name(self, source_rel):
+        """
+        Name of the path mapper that maps a source path
+
+        @param source_rel: Source-relative path
+        @type source_rel: str
+        @rtype: str|None
+        """
+        for mapper in self.env.mappers:
+            if mapper.match(path(source_rel)):
+                return mapper.__class__.__name__
+        return None
+
+    def collect(self):
+        """
+        Record every output of the build. Content hashes come from the output writer where it wrote or checked the
+        output, from the previous manifest where the size and mtime still match, and otherwise from reading the output.
+        """
+        origins = dict()
+        if self.env.cache:
+            for entry in self.env.cache.outputs.values():
+                for rel in entry['files']:
+                    origins[rel] = (entry['source'], entry['handler'])
+        for rel in self.env.writer.produced:
+            origins.setdefault(rel, (None, None))
+
+        for (rel, (source, handler)) in origins.items():
+            file_path = self.env.dest_dir.joinpath(rel)
+            if not file_path.isfile():
+                continue
+
+            st = file_path.stat()
+            digest = self.env.writer.produced.get(rel)
+            known = self.previous.get(rel)
+            if not digest and known and known['size'] == st.st_size and known['mtime'] == st.st_mtime:
+                digest = known['sha1']
+            if not digest:
+                digest = hashlib.sha1(open(file_path, 'rb').read()).hexdigest()
+
+            self.outputs[rel] = dict(source=source, handler=handler, mapper=source and self.mapper_name(source),
+                                     size=st.st_size, mtime=st.st_mtime, sha1=digest)
+
+    def diff(self):
+        """
+        Compare with the previous manifest
+
+        @return: Added, changed and removed outputs, sorted
+        @rtype: dict
+        """
+        added = sorted(rel for rel in self.outputs if rel not in self.previous)
+        changed = sorted(rel for (rel, entry) in self.outputs.items()
+                         if rel in self.previous and self.previous[rel]['sha1'] != entry['sha1'])
+        removed = sorted(rel for rel in self.previous if rel not in self.outputs)
+        return dict(added=added, changed=changed, removed=removed)
+
+    def save(self):
+        """
+        Write out the manifest, the diff and the lists of files to upload and delete
+
+        @return: The diff
+        @rtype: dict
+        """
+        diff = self.diff()
+        self.manifest_dir.makedirs_p()
+        json.dump(dict(version=self.version, outputs=self.outputs),
+                  open(self.manifest_dir.joinpath(self.manifest_name), 'w'), indent=1, sort_keys=True)
+        json.dump(diff, open(self.manifest_dir.joinpath('diff.json'), 'w'), indent=1, sort_keys=True)
+        self.manifest_dir.joinpath('changed.txt').write_lines(diff['added'] + diff['changed'])
+        self.manifest_dir.joinpath('removed.txt').write_lines(diff['removed'])
+        return diff
+
+
+class Publisher(object):
+    """
+    Puts static files into the destination. How depends on the mode:
+
+     * copy - a plain copy
+     * hardlink - hard link the output to the source, so nothing is copied at all (so don't edit outputs in place)
+     * reflink - copy-on-write clone, on filesystems that support it (btrfs, XFS)
+     * copy_file_range - copy inside the kernel, calling copy_file_range (or sendfile on older systems) in libc
+
+    Modes that can't be used for a particular file fall back to a plain copy. Whatever the mode, an output that already
+    holds the same content as the source is left alone. Publishing carries the source's mtime across, so an output
+    whose size and mtime match is taken as the same without reading it; one whose size matches but mtime doesn't
+    (such as a deduped hard link) has its content hash compared. With dedupe on, files with identical content are only
+    stored once in the destination - later ones are hard links to the first.
+
+    Outputs are always published to a temporary file alongside and renamed over the old one, so a half-published
+    output is never visible and writing an output never writes through a hard link.
+    """
+    modes = ('copy', 'hardlink', 'reflink', 'copy_file_range')
+
+    # ioctl request for a reflink clone on Linux
+    FICLONE = 0x40049409
+    # libc through ctypes, once it's been looked for (False if it isn't there)
+    libc = None
+
+    env = None
+    mode = 'copy'
+    dedupe = False
+
+    def __init__(self, env, mode='copy', dedupe=False):
+        """
+        @param env: Build environment
+        @type env: BuildEnvironment
+        @param mode: copy, hardlink, reflink or copy_file_range
+        @type mode: str
+        @param dedupe: Store files with identical content once
+        @type dedupe: bool
+        """
+        if mode not in self.modes:
+            raise ValueError("Unknown publishing mode %s, use one of %s" % (mode, ", ".join(self.modes)))
+
+        self.env = env
+        self.mode = mode
+        self.dedupe = dedupe
+        self.published = dict()
+        self.counts = dict(unchanged=0, linked=0, copied=0)
+
+    def hash(self, file_path):
         """
-        Write the conversion of this file out to the given path
+        Content hash of a file, going through the build cache for source files
 
-        @param file_path: Absolute path to write conversion out to
+        @param file_path: File path
         @type file_path: path
+        @return: Hex digest
+        @rtype: str
         """
-        raise NotImplementedError()
+        if self.env.cache and file_path.startswith(self.env.source_dir):
+            return self.env.cache.hash_file(file_path)
+        return hashlib.sha1(open(file_path, 'rb').read()).hexdigest()
 
-    def ensure_output_dir(self, file_path):
+    def identical(self, source, dest):
         """
-        Ensure the dir for the given file path exists
+        Does dest already hold the same file as source?
 
-        @param file_path: Path of file or dir
-        @type file_path: path
+        @param source: Source file
+        @type source: path
+        @param dest: Destination file
+        @type dest: path
+        @rtype: bool
         """
+        if not dest.isfile():
+            return False
+        if os.path.samefile(source, dest):
+            return True
 
-        # Ensure parent directory exists
-        if not file_path.parent.isdir():
-            file_path.parent.makedirs()
-
+        source_stat = source.stat()
+        dest_stat = dest.stat()
+        if source_stat.st_size != dest_stat.st_size:
+            return False
+        # utime only carries the mtime across to the microsecond
+        if abs(source_stat.st_mtime - dest_stat.st_mtime) < 0.000001:
+            return True
 
-class AnyFileHandler(BaseFileHandler):
-    """
-    Handle any file at all, by simply copying it
-    """
-    def match(self, file_path):
-        """
-        This handler matches all files
+        return self.hash(source) == self.hash(dest)
+
+    def publish(self, source, dest):
+        """
+        Publish a source file to the destination
+
+        @param source: Source file
+        @type source: path
+        @param dest: Destination file
+        @type dest: path
+        """
+        self.env.writer.claim(dest)
+        if self.identical(source, dest):
+            log.debug("%s is already published" % dest)
+            self.counts['unchanged'] += 1
+            if self.dedupe:
+                self.published.setdefault(self.hash(source), dest)
+            return
+
+        temp_path = dest.parent.joinpath('.%s.%d.%d.tmp' % (dest.name, os.getpid(),
+                                                             threading.current_thread().ident))
+        temp_path.remove_p()
+        try:
+            self.place(source, temp_path, dest)
+            os.rename(temp_path, dest)
+        except:
+            temp_path.remove_p()
+            raise
+
+    def place(self, source, temp_path, dest):
+        """
+        Put a copy of (or link to) source at the temporary path that's about to be renamed over dest
+
+        @param source: Source file
+        @type source: path
+        @param temp_path: Temporary file next to dest
+        @type temp_path: path
+        @param dest: Destination file
+        @type dest: path
+        """
+        if self.dedupe:
+            digest = self.hash(source)
+            first = self.published.get(digest)
+            if first and first.isfile() and self.link(first, temp_path):
+                log.debug("%s has the same content as %s, linked" % (dest, first))
+                return
+            self.published[digest] = dest
+
+        if self.mode == 'hardlink' and self.link(source, temp_path):
+            return
+
+        if self.mode == 'reflink' and self.reflink(source, temp_path):
+            pass
+        elif self.mode == 'copy_file_range' and self.kernel_copy(source, temp_path):
+            pass
+        else:
+            source.copy(temp_path)
+
+        # Carry the mtime across so the next build (and rsync) can tell the file hasn't changed
+        source_stat = source.stat()
+        os.utime(temp_path, (source_stat.st_atime, source_stat.st_mtime))
+        self.counts['copied'] += 1
+
+    def link(self, source, dest):
+        """
+        Hard link dest to source
+
+        @return: Whether it worked
+        @rtype: bool
         """
+        try:
+            os.link(source, dest)
+        except OSError as e:
+            log.debug("Could not hard link %s to %s (%s), copying instead" % (dest, source, e))
+            return False
+        self.counts['linked'] += 1
         return True
-    
-    def load(self, file_path):
+
+    def reflink(self, source, dest):
         """
-        Create the AnyFile from the path
-        
-        @param file_path: File to load
-        @type file_path: path
+        Clone source to dest, sharing the data blocks until either is changed
+
+        @return: Whether it worked
+        @rtype: bool
         """
-        af = AnyFile(self.env, self)
-        af.read_from(file_path)
-        return af
+        try:
+            import fcntl
+        except ImportError:
+            return False
 
+        try:
+            with open(source, 'rb') as source_file:
+                with open(dest, 'wb') as dest_file:
+                    fcntl.ioctl(dest_file.fileno(), self.FICLONE, source_file.fileno())
+        except (IOError, OSError) as e:
+            log.debug("Could not reflink %s to %s (%s), copying instead" % (dest, source, e))
+            dest.remove_p()
+            return False
 
-class AnyFile(BaseFile):
-    """
-    Represent any file at all by holding the original file path then copying on request.
-    """
-    def read_from(self, file_path):
-        """
-        "Read" the file from the given file_path
+        source.copymode(dest)
+        return True
 
-        @param file_path: Path to file to read
-        @type file_path: path
-        """
-        self.file_path = file_path
-    
-    def write_to(self, file_path):
+    def kernel_copy(self, source, dest):
         """
-        Write the file to the given file_path by copying from the read path. This will create any directories required
-        to succeed.
+        Copy source to dest without passing the data through userspace
 
-        @param file_path: Path to write to
-        @type file_path: path
+        @return: Whether it worked
+        @rtype: bool
         """
+        copy = self.kernel_copier()
+        if not copy:
+            return False
 
-        self.ensure_output_dir(file_path)
-        self.file_path.copy(file_path)
+        try:
+            with open(source, 'rb') as source_file:
+                with open(dest, 'wb') as dest_file:
+                    remaining = source.size
+                    while remaining > 0:
+                        sent = copy(source_file.fileno(), dest_file.fileno(), remaining)
+                        if not sent:
+                            break
+                        remaining -= sent
+            if remaining > 0:
+                raise IOError("%s was cut short" % dest)
+        except (IOError, OSError) as e:
+            log.debug("Could not copy %s in the kernel (%s), copying instead" % (source, e))
+            dest.remove_p()
+            return False
+
+        source.copymode(dest)
+        return True
+
+    def kernel_copier(self):
+        """
+        Function copying from one file descriptor to another inside the kernel, calling copy_file_range in libc, or
+        sendfile if there's no copy_file_range. Both carry on from, and move on, the descriptors' own offsets.
+
+        @return: Copier taking source_fd, dest_fd and count, returning the bytes copied and raising OSError, or None
+            if libc has neither
+        @rtype: callable|None
+        """
+        if Publisher.libc is None:
+            try:
+                import ctypes
+                import ctypes.util
+                Publisher.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            except (ImportError, OSError):
+                Publisher.libc = False
+        if not Publisher.libc:
+            return None
+
+        import ctypes
+        libc = Publisher.libc
+        if hasattr(libc, 'copy_file_range'):
+            call = libc.copy_file_range
+            call.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t,
+                             ctypes.c_uint]
+            call.restype = ctypes.c_ssize_t
+            syscall = lambda source_fd, dest_fd, count: call(source_fd, None, dest_fd, None, count, 0)
+        elif hasattr(libc, 'sendfile'):
+            call = libc.sendfile
+            call.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+            call.restype = ctypes.c_ssize_t
+            syscall = lambda source_fd, dest_fd, count: call(dest_fd, source_fd, None, count)
+        else:
+            return None
+
+        def copy(source_fd, dest_fd, count):
+            sent = syscall(source_fd, dest_fd, count)
+            if sent < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return sent
+        return copy
 
 
 class Jinja2FileHandler(BaseFileHandler):
     """
     File handler for .jinja2 files
     """
-
+    extensions = ('.jinja2',)
     jinja2_env = None
 
     def __init__(self, env):
@@ -471,14 +2680,29 @@ class Jinja2FileHandler(BaseFileHandler):
             @type env: BuildEnvironment
         """
         super(Jinja2FileHandler, self).__init__(env)
-        self.jinja2_env = jinja2.Environment(extensions=[Markdown2Extension],
-                                             loader=jinja2.FileSystemLoader(self.env.source_dir))
+        bytecode_cache = None
+        if self.env.cache:
+            # Compiled templates are kept between builds, Jinja2 checks them against the template source on load. Kept
+            # apart by the name they use for the markdown extension, as that isn't part of the check.
+            bytecode_dir = self.env.cache.cache_dir.joinpath('jinja2', Markdown2Extension.identifier)
+            bytecode_dir.makedirs_p()
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_dir)
+
+        self.jinja2_env = RecordingEnvironment(extensions=[Markdown2Extension],
+                                               loader=jinja2.FileSystemLoader(self.env.source_dir),
+                                               bytecode_cache=bytecode_cache)
+        self.jinja2_env.statin_env = self.env
+        # Share the build's markdown cache with the {% markdown %} tag
+        self.jinja2_env.markdowner = self.env.markdown
 
         # Register various useful global functions
-        self.jinja2_env.globals['grab'] = self.jinja2_grab
-        self.jinja2_env.globals['select'] = self.jinja2_select
-        self.jinja2_env.globals['glob'] = self.jinja2_glob
-        self.jinja2_env.globals['map'] = self.env.map
+        profiler = self.env.profiler
+        self.jinja2_env.globals['grab'] = profiler.wrap('global', 'grab', self.jinja2_grab)
+        self.jinja2_env.globals['select'] = profiler.wrap('global', 'select', self.jinja2_select)
+        self.jinja2_env.globals['glob'] = profiler.wrap('global', 'glob', self.jinja2_glob)
+        self.jinja2_env.globals['map'] = profiler.wrap('global', 'map', self.env.map)
+        self.jinja2_env.globals['summary'] = profiler.wrap('global', 'summary', self.jinja2_summary)
+        self.jinja2_env.globals['image'] = profiler.wrap('global', 'image', self.jinja2_image)
 
     def match(self, file_path):
         """
@@ -503,6 +2727,23 @@ class Jinja2FileHandler(BaseFileHandler):
         f.read_from(file_path)
         return f
 
+    def precompile(self):
+        """
+        Compile every template in the source tree into the bytecode cache ahead of time
+
+        @return: Number of templates compiled
+        @rtype: int
+        """
+        count = 0
+        for file_path in self.env.source_dir.walkfiles('*.jinja2'):
+            name = str(self.env.source_dir.relpathto(file_path))
+            try:
+                self.jinja2_env.get_template(name)
+                count += 1
+            except jinja2.TemplateSyntaxError as e:
+                log.warn("Could not compile %s: %s" % (name, e))
+        return count
+
     def jinja2_grab(self, file_path):
         """
         Grab a source file
@@ -514,9 +2755,33 @@ class Jinja2FileHandler(BaseFileHandler):
         """
         return self.env.get(self.env.source_dir.joinpath(file_path))
 
+    def jinja2_summary(self, file_path):
+        """
+        Look up the summary of a source document, such as its title and lead paragraph, without rendering it again
+
+        @param file_path: Relative path to source file
+        @type file_path: basestring|path
+        @return: Summary, see BuildEnvironment.summarise
+        @rtype: dict
+        """
+        return self.env.summary(self.env.source_dir.joinpath(file_path))
+
+    def jinja2_image(self, file_path):
+        """
+        Look up an image, for its URL, size and derivatives
+
+        @param file_path: Relative path to image
+        @type file_path: basestring|path
+        @return: Image
+        @rtype: ImageFile
+        """
+        return self.env.get(self.env.source_dir.joinpath(file_path))
+
     def jinja2_select(self, html, selector):
         """
-        Perform a pyquery select on given HTML
+        Perform a pyquery select on given HTML. Parsed documents are cached for the whole build by the hash of the
+        HTML, so selecting several things from the same HTML only parses it once. That also means the documents are
+        shared, so don't modify what comes back.
 
         @param html: HTML string
         @type html: basestring
@@ -524,7 +2789,12 @@ class Jinja2FileHandler(BaseFileHandler):
         @type selector: basestring
         @return: Result of query
         """
-        return pq(html)(selector)
+        key = content_hash(html)
+        document = self.env.dom_cache.get(key)
+        if document is None:
+            document = pq(html)
+            self.env.dom_cache.put(key, document)
+        return document(selector)
 
     def jinja2_glob(self, pattern):
         """
@@ -535,7 +2805,8 @@ class Jinja2FileHandler(BaseFileHandler):
         @return: List of matching paths
         @rtype: list
         """
-        return [self.env.source_dir.relpathto(p) for p in self.env.source_dir.glob(pattern)]
+        self.env.depend('glob', pattern)
+        return [self.env.source_dir.relpathto(p) for p in self.env.sources.glob(pattern)]
 
 
 
@@ -572,8 +2843,8 @@ class Jinja2File(BaseFile):
         @type file_path: path
         """
 
-        self.ensure_output_dir(file_path)
-        open(file_path, 'w').write(self.template.render(source_path=self.file_path, destination_path=file_path, dispatch_type=self.jinja2_dispatch_type, path=path, url=self.env.map(self.file_path), to_root=self.jinja2_to_root(), **kwargs))
+        with self.env.rendering(self.env.source_dir.relpathto(self.file_path)):
+            self.env.writer.write(file_path, self.template.render(source_path=self.file_path, destination_path=file_path, dispatch_type=self.env.profiler.wrap('global', 'dispatch_type', self.jinja2_dispatch_type), path=path, url=self.env.map(self.file_path), to_root=self.jinja2_to_root(), **kwargs))
 
     def as_html(self, **kwargs):
         """
@@ -582,7 +2853,22 @@ class Jinja2File(BaseFile):
         @return: HTML
         @rtype: basestring
         """
-        return self.template.render(to_root=self.jinja2_to_root(), **kwargs)
+        if kwargs:
+            # Rendered with extra context it's not the document itself, so it doesn't go into the summary index
+            with self.env.rendering(self.env.source_dir.relpathto(self.file_path)):
+                return self.template.render(to_root=self.jinja2_to_root(), **kwargs)
+
+        return self.env.summarise(self.file_path, self.render)
+
+    def render(self):
+        """
+        Render the template on its own
+
+        @return: HTML
+        @rtype: basestring
+        """
+        with self.env.rendering(self.env.source_dir.relpathto(self.file_path)):
+            return self.template.render(to_root=self.jinja2_to_root())
 
     def jinja2_to_root(self):
         """
@@ -607,6 +2893,7 @@ class MarkdownFileHandler(BaseFileHandler):
     """
     Handle Markdown (.md) files
     """
+    extensions = ('.md',)
     markdown = None
 
     def __init__(self, env):
@@ -614,7 +2901,41 @@ class MarkdownFileHandler(BaseFileHandler):
         Set up handler for Markdown files
         """
         super(MarkdownFileHandler, self).__init__(env)
-        self.markdown = markdown2.Markdown(extras=['fenced-code-blocks', 'footnotes', 'header-ids'])
+        self.markdown = self.env.markdown
+        self.templates = dict()
+
+    def resolve_template(self, dir_path):
+        """
+        Find the nearest _auto-md.jinja2 for a directory, inheriting the answer from the parent directory
+
+        @param dir_path: Absolute directory path
+        @type dir_path: path
+        @return: Template path (or None) and every candidate path looked at on the way
+        @rtype: tuple
+        """
+        if dir_path not in self.templates:
+            candidate = dir_path.joinpath('_auto-md.jinja2')
+            if self.env.sources.stat(candidate) is not None:
+                log.debug("Found template for Markdown in %s" % dir_path)
+                self.templates[dir_path] = (candidate, (candidate,))
+            elif dir_path == self.env.source_dir or not dir_path.startswith(self.env.source_dir):
+                self.templates[dir_path] = (None, (candidate,))
+            else:
+                (template_path, candidates) = self.resolve_template(dir_path.parent)
+                self.templates[dir_path] = (template_path, (candidate,) + candidates)
+
+        return self.templates[dir_path]
+
+    def get_template(self, template_path):
+        """
+        Loaded template, shared between every Markdown file that uses it
+
+        @param template_path: Template path
+        @type template_path: path
+        @return: Template representation
+        @rtype: Jinja2File
+        """
+        return self.env.get(template_path)
 
     def match(self, file_path):
         """
@@ -662,8 +2983,7 @@ class MarkdownFile(BaseFile):
         @type file_path: path
         """
 
-        self.ensure_output_dir(file_path)
-        open(file_path, 'w').write(self.as_templated_html())
+        self.env.writer.write(file_path, self.as_templated_html())
 
     def as_html(self):
         """
@@ -672,7 +2992,8 @@ class MarkdownFile(BaseFile):
         @return: HTML
         @rtype: str|unicode
         """
-        return self.handler.markdown.convert(open(self.file_path, 'r').read())
+        return self.env.summarise(self.file_path,
+                                  lambda: self.handler.markdown.convert(open(self.file_path, 'r').read()))
 
     def find_template(self):
         """
@@ -681,15 +3002,11 @@ class MarkdownFile(BaseFile):
         @return: The template, or None
         @rtype: path|None
         """
-        template_path = self.file_path
-        while template_path != self.env.source_dir:
-            template_path = template_path.parent
-            log.debug("Looking for template for %s" % template_path.joinpath('_auto-md.jinja2'))
-            if template_path.joinpath('_auto-md.jinja2').exists():
-                log.debug("Found template for Markdown in %s" % template_path)
-                return template_path.joinpath('_auto-md.jinja2')
-
-        return None
+        (template_path, candidates) = self.handler.resolve_template(self.file_path.parent)
+        # A nearer template turning up later would change our output, so depend on the ones that aren't there too
+        for candidate in candidates:
+            self.env.depend('file', candidate)
+        return template_path
 
     def as_templated_html(self):
         """
@@ -704,14 +3021,47 @@ class MarkdownFile(BaseFile):
             return self.as_html()
 
         content = open(self.file_path, 'r').read()
-        template = self.env.get(template_path)
+        template = self.handler.get_template(template_path)
         return template.as_html(content=content)
 
 
+class LessCompileError(Exception):
+    """
+    Exception to be raised when lessc fails on one or more stylesheets
+    """
+    pass
+
+
 class LessFileHandler(BaseFileHandler):
     """
-    Compile a provided less file
+    Compile provided less files.
+
+    Compilations run in a bounded pool of lessc subprocesses while the rest of the build carries on, and any failures
+    are raised together once the build finishes. Compiled CSS is cached by the hash of the stylesheet and everything
+    it @imports, so a stylesheet is only recompiled when something in its import graph changed.
     """
+    extensions = ('.less',)
+    # Most lessc processes to run at once
+    jobs = 4
+
+    import_re = re.compile(r'''@import\s*(?:\([^)]*\)\s*)?(?:url\(\s*)?["']([^"']+)["']''')
+
+    def __init__(self, env):
+        """
+        Set up handler for .less files
+
+        @param env: Build environment
+        @type env: BuildEnvironment
+        """
+        super(LessFileHandler, self).__init__(env)
+        self.pool = None
+        self.pending = []
+        self.closures = dict()
+        self.lessc = None
+        self.cache_dir = None
+        if self.env.cache:
+            self.cache_dir = self.env.cache.cache_dir.joinpath('less')
+
     def match(self, file_path):
         """
         Match .less files
@@ -736,6 +3086,105 @@ class LessFileHandler(BaseFileHandler):
         f.read_from(file_path)
         return f
 
+    def imports(self, file_path):
+        """
+        Everything a stylesheet pulls in through @import, directly or indirectly. Imports of plain CSS or remote
+        stylesheets are left to lessc.
+
+        @param file_path: Path to .less file
+        @type file_path: path
+        @return: Paths of imported .less files
+        @rtype: set
+        """
+        if file_path in self.closures:
+            return self.closures[file_path]
+
+        # Guard against import loops while we work
+        self.closures[file_path] = set()
+        closure = set()
+        if file_path.isfile():
+            for name in self.import_re.findall(open(file_path, 'r').read()):
+                if '://' in name or name.endswith('.css'):
+                    continue
+                imported = file_path.parent.joinpath(name).abspath()
+                if not imported.ext:
+                    imported += '.less'
+                closure.add(imported)
+                closure.update(self.imports(imported))
+
+        self.closures[file_path] = closure
+        return closure
+
+    def compile(self, source_path, output_path, key):
+        """
+        Queue a stylesheet for compiling
+
+        @param source_path: Path to .less file
+        @type source_path: path
+        @param output_path: Path for the .css file
+        @type output_path: path
+        @param key: Hash of the stylesheet and its imports
+        @type key: str
+        """
+        cached_path = self.cache_dir.joinpath(key + '.css') if self.cache_dir else None
+        if cached_path and cached_path.isfile():
+            log.debug("Using cached CSS for %s" % source_path)
+            self.env.writer.write(output_path, open(cached_path, 'rb').read())
+            return
+
+        if self.lessc is None:
+            self.lessc = bool(find_executable('lessc'))
+            if not self.lessc:
+                log.warn("lessc isn't available, .less files won't be compiled. Try npm install -g less")
+        if not self.lessc:
+            return
+
+        if not self.pool:
+            self.pool = ThreadPool(self.jobs)
+        self.pending.append((source_path, self.pool.apply_async(self.run_lessc, (source_path, output_path,
+                                                                                  cached_path))))
+
+    def run_lessc(self, source_path, output_path, cached_path):
+        """
+        Run lessc on a stylesheet, in a pool thread
+
+        @return: Error output, or None if it compiled
+        @rtype: str|None
+        """
+        process = subprocess.Popen(['lessc', source_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (css, errors) = process.communicate()
+        if process.returncode:
+            return errors.strip() or "lessc exited with %d" % process.returncode
+
+        self.env.writer.write(output_path, css)
+        if cached_path:
+            cached_path.parent.makedirs_p()
+            temp_path = cached_path + '.%d.tmp' % os.getpid()
+            open(temp_path, 'wb').write(css)
+            temp_path.rename(cached_path)
+        return None
+
+    def finish(self):
+        """
+        Wait for queued stylesheets to compile, raising LessCompileError if any failed. The pool is shut down, a later
+        compile starts a new one.
+        """
+        failures = []
+        try:
+            for (source_path, result) in self.pending:
+                error = result.get()
+                if error:
+                    failures.append("%s: %s" % (self.env.source_dir.relpathto(source_path), error))
+        finally:
+            self.pending = []
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+        if failures:
+            raise LessCompileError("\n".join(failures))
+
 
 class LessFile(BaseFile):
     """
@@ -750,17 +3199,515 @@ class LessFile(BaseFile):
         """
         self.file_path = file_path
 
-    def write_to(self, file_path):
+    def dependencies(self):
+        """
+        The stylesheet and everything it imports
+
+        @return: Source paths
+        @rtype: list
+        """
+        return [self.file_path] + sorted(self.handler.imports(self.file_path))
+
+    def write_to(self, file_path):
+        """
+        Write out a compiled version of the .less file to a given path. The compile finishes in the background.
+
+        @param file_path: Path for .css file
+        @type file_path: path
+        """
+        self.ensure_output_dir(file_path)
+        output_file_path = file_path.stripext() + '.css'
+
+        digest = hashlib.sha1()
+        for dep in self.dependencies():
+            digest.update(str(self.env.source_dir.relpathto(dep)))
+            if self.env.cache:
+                digest.update(str(self.env.cache.hash_file(dep)))
+            elif dep.isfile():
+                digest.update(content_hash(open(dep, 'rb').read()))
+
+        self.handler.compile(self.file_path, output_file_path, digest.hexdigest())
+
+    def output_paths(self, file_path):
+        """
+        The compiled stylesheet lands next to where the .less file would have gone
+
+        @param file_path: Path passed to write_to
+        @type file_path: path
+        @return: Written paths
+        @rtype: list
+        """
+        return [file_path.stripext() + '.css']
+
+
+class ImageProcessError(Exception):
+    """
+    Exception to be raised when one or more image derivatives couldn't be made
+    """
+    pass
+
+
+def make_derivative(source_path, width, height, format, quality):
+    """
+    Resize an image and convert it to another format, in an image pool process
+
+    @param source_path: Path to the original image
+    @type source_path: path
+    @param width: Width to resize to
+    @type width: int
+    @param height: Height to resize to
+    @type height: int
+    @param format: PIL format name, such as jpeg
+    @type format: str
+    @param quality: Encoding quality, for the formats that have one
+    @type quality: int
+    @return: Encoded image
+    @rtype: str
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(source_path)
+    if hasattr(ImageOps, 'exif_transpose'):
+        image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    if format == 'jpeg' and image.mode != 'L':
+        image = image.convert('RGB')
+
+    image = image.resize((width, height), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format.upper(), quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class ImageFileHandler(BaseFileHandler):
+    """
+    Publish images, along with resized and converted derivatives of them if the directory's _index.yml asks for
+    any:
+
+        images:
+          widths: [320, 640, 1280]
+          formats: [webp, jpeg]
+          quality: 80
+
+    Each width is made in each format (the original's format if none are given), so photo.jpg gets photo-320.webp,
+    photo-320.jpg and so on alongside it. Widths are capped at the original's width. Set original to false to
+    leave the original out of the destination.
+
+    Derivatives are made in a pool of processes while the rest of the build carries on, and any failures (including
+    images that can't be read) are raised together once the build finishes. They're cached by the hash of the original
+    and the parameters they were made with, so an image is never processed twice while it's still in the cache. The
+    cache is trimmed back to the environment's image_cache_bytes, least recently used first, if that's set. Making derivatives needs PIL (or Pillow); without it the originals are
+    published as they are.
+    """
+    extensions = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+    # Processes to make derivatives in, None for one per CPU
+    jobs = None
+    # Bump to make every cached derivative again
+    version = 1
+    # Bytes added to the derivatives cache since it was last trimmed
+    written = 0
+
+    # PIL format names with the extension and MIME type of their files
+    formats = {
+        'jpeg': ('.jpg', 'image/jpeg'),
+        'png': ('.png', 'image/png'),
+        'gif': ('.gif', 'image/gif'),
+        'webp': ('.webp', 'image/webp'),
+    }
+    # PIL format names of originals by extension
+    extension_formats = {
+        '.jpg': 'jpeg',
+        '.jpeg': 'jpeg',
+        '.png': 'png',
+        '.gif': 'gif',
+        '.webp': 'webp',
+    }
+    defaults = dict(widths=[], formats=[], quality=85, original=True)
+
+    def __init__(self, env):
+        """
+        Set up handler for images
+
+        @param env: Build environment
+        @type env: BuildEnvironment
+        """
+        super(ImageFileHandler, self).__init__(env)
+        self.pool = None
+        self.pending = []
+        self.failures = []
+        self.lock = threading.Lock()
+        self.sizes = dict()
+        self.pil = None
+        self.cache_dir = None
+        if self.env.cache:
+            self.cache_dir = self.env.cache.cache_dir.joinpath('images')
+
+    def match(self, file_path):
+        """
+        Match image files
+
+        @param file_path: File path
+        @type file_path: path
+        @return: Is an image?
+        @rtype: bool
+        """
+        return file_path.ext.lower() in self.extensions
+
+    def load(self, file_path):
+        """
+        Return an image file representation
+
+        @param file_path: Path to image
+        @type file_path: path
+        @return: Image file
+        @rtype: ImageFile
+        """
+        f = ImageFile(self.env, self)
+        f.read_from(file_path)
+        return f
+
+    def available(self):
+        """
+        Can derivatives be made? Warns, once, if they can't.
+
+        @rtype: bool
+        """
+        if self.pil is None:
+            try:
+                importlib.import_module('PIL.Image')
+                self.pil = True
+            except ImportError:
+                self.pil = False
+                log.warn("PIL isn't available, images will be published without derivatives. Try pip install Pillow")
+        return self.pil
+
+    def settings(self, dir_path):
+        """
+        Image settings for a directory, from its _index.yml
+
+        @param dir_path: Source directory
+        @type dir_path: path
+        @return: widths, formats, quality and original
+        @rtype: dict
+        """
+        self.env.depend('file', dir_path.joinpath('_index.yml'))
+        settings = dict(self.defaults)
+        type_ = self.env.load_type(dir_path)
+        if type_ is not None:
+            settings.update(type_.meta.get('images') or dict())
+        for format in settings['formats']:
+            if format not in self.formats:
+                raise ValueError("Unknown image format %s in %s, use one of %s" %
+                                 (format, self.env.source_dir.relpathto(dir_path), ", ".join(sorted(self.formats))))
+        return settings
+
+    def measure(self, file_path):
+        """
+        Width and height of an image, as it's displayed. Going by the header alone, and remembered in the build
+        cache between builds.
+
+        @param file_path: Path to image
+        @type file_path: path
+        @return: Width and height, both None if they can't be found out (such as for a corrupt image, which is
+            reported when the build finishes)
+        @rtype: tuple
+        """
+        self.env.depend('file', file_path)
+        if file_path in self.sizes:
+            return self.sizes[file_path]
+        if not self.available():
+            return (None, None)
+
+        known = self.env.cache.recall('image', file_path) if self.env.cache else None
+        if known:
+            self.sizes[file_path] = tuple(known[0]['size'])
+            return self.sizes[file_path]
+
+        from PIL import Image
+        try:
+            image = Image.open(file_path)
+            (width, height) = image.size
+            # EXIF orientations 5 to 8 are turned on their side
+            exif = image.getexif() if hasattr(image, 'getexif') else dict()
+            if exif.get(0x0112) in (5, 6, 7, 8):
+                (width, height) = (height, width)
+        except Exception, e:
+            # Reported with the derivatives that couldn't be made once the build finishes
+            with self.lock:
+                self.failures.append("%s: %s" % (self.env.source_dir.relpathto(file_path), e))
+            self.sizes[file_path] = (None, None)
+            return self.sizes[file_path]
+        self.sizes[file_path] = (width, height)
+
+        if self.env.cache:
+            self.env.cache.begin()
+            self.env.cache.depend('file', file_path)
+            self.env.cache.remember('image', file_path, dict(size=[width, height]), self.env.cache.end())
+        return self.sizes[file_path]
+
+    def derive(self, source_path, derivative, quality):
+        """
+        Queue a derivative of an image to be made
+
+        @param source_path: Path to the original image
+        @type source_path: path
+        @param derivative: Derivative, see ImageFile.derivatives_for
+        @type derivative: dict
+        @param quality: Encoding quality
+        @type quality: int
+        """
+        digest = hashlib.sha1()
+        digest.update(str(self.version))
+        if self.env.cache:
+            digest.update(str(self.env.cache.hash_file(source_path)))
+        else:
+            digest.update(content_hash(open(source_path, 'rb').read()))
+        digest.update("%(width)d %(height)d %(format)s" % derivative)
+        digest.update(str(quality))
+
+        dest_path = derivative['path']
+        cached_path = self.cache_dir.joinpath(digest.hexdigest() + dest_path.ext) if self.cache_dir else None
+        if cached_path and cached_path.isfile():
+            log.debug("Using cached %s" % dest_path)
+            self.env.writer.write(dest_path, open(cached_path, 'rb').read())
+            # Touch it so trimming sees it as recently used
+            cached_path.utime(None)
+            return
+
+        args = (source_path, derivative['width'], derivative['height'], derivative['format'], quality)
+        if multiprocessing.current_process().daemon:
+            # Worker processes of a parallel build can't have processes of their own, and are already one of many
+            try:
+                self.derived(dest_path, cached_path, make_derivative(*args))
+            except Exception, e:
+                self.failures.append("%s: %s" % (self.env.dest_dir.relpathto(dest_path), e))
+            return
+
+        if not self.pool:
+            self.pool = multiprocessing.Pool(self.jobs)
+        callback = lambda content: self.derived(dest_path, cached_path, content)
+        self.pending.append((dest_path, self.pool.apply_async(make_derivative, args, callback=callback)))
+
+    def derived(self, dest_path, cached_path, content):
+        """
+        Write out a derivative once it's made, and cache it
+
+        @param dest_path: Destination path
+        @type dest_path: path
+        @param cached_path: Where to cache it, if anywhere
+        @type cached_path: path|None
+        @param content: Encoded image
+        @type content: str
+        """
+        self.env.writer.write(dest_path, content)
+        if not cached_path:
+            return
+
+        try:
+            cached_path.parent.makedirs_p()
+            temp_path = cached_path + '.%d.tmp' % os.getpid()
+            open(temp_path, 'wb').write(content)
+            temp_path.rename(cached_path)
+        except (IOError, OSError), e:
+            with self.lock:
+                self.failures.append("%s: %s" % (cached_path, e))
+            return
+        with self.lock:
+            self.written += len(content)
+
+    def finish(self):
+        """
+        Wait for queued derivatives to be made, raising ImageProcessError if any couldn't be
+        """
+        failures = []
+        for (dest_path, result) in self.pending:
+            try:
+                result.get()
+            except Exception, e:
+                failures.append("%s: %s" % (self.env.dest_dir.relpathto(dest_path), e))
+        self.pending = []
+        with self.lock:
+            failures += self.failures
+            self.failures = []
+
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        if self.cache_dir and self.env.image_cache_bytes is not None:
+            trim_cache_dir(self.cache_dir, self.env.image_cache_bytes, self.written)
+            self.written = 0
+
+        if failures:
+            raise ImageProcessError("\n".join(sorted(failures)))
+
+
+class ImageFile(BaseFile):
+    """
+    Represent an image. Templates get at it through image() or a gallery's images, for its URL, size and the URLs of
+    its derivatives, say for srcset:
+
+        <img src="{{ to_root }}/{{ photo.url }}" srcset="{{ photo.srcset(to_root) }}" sizes="50vw">
+    """
+    def read_from(self, file_path):
+        """
+        "Read" an image, nothing is read until something asks
+
+        @param file_path: Path to image
+        @type file_path: path
+        """
+        self.file_path = file_path
+
+    @property
+    def settings(self):
+        """
+        Image settings of the directory the image is in
+
+        @rtype: dict
+        """
+        return self.handler.settings(self.file_path.parent)
+
+    @property
+    def url(self):
+        """
+        URL of the original, relative to the root
+
+        @rtype: str
+        """
+        return str(self.env.map(self.file_path))
+
+    @property
+    def width(self):
+        """
+        @return: Width of the original, None without PIL
+        @rtype: int|None
+        """
+        return self.handler.measure(self.file_path)[0]
+
+    @property
+    def height(self):
+        """
+        @return: Height of the original, None without PIL
+        @rtype: int|None
+        """
+        return self.handler.measure(self.file_path)[1]
+
+    @property
+    def derivatives(self):
+        """
+        Derivatives of the image, see derivatives_for
+
+        @rtype: list
+        """
+        return self.derivatives_for(self.env.to_dest(self.file_path))
+
+    def derivatives_for(self, dest_path):
+        """
+        Every derivative the directory's settings ask for, by format then width. Each one has its width, height,
+        format, MIME type, destination path and URL relative to the root. Without PIL there are none.
+
+        @param dest_path: Destination of the original
+        @type dest_path: path
+        @return: Derivatives
+        @rtype: list
+        """
+        settings = self.settings
+        if not settings['widths'] or not self.handler.available():
+            return []
+
+        (width, height) = self.handler.measure(self.file_path)
+        if width is None:
+            return []
+        formats = settings['formats'] or [self.format]
+        derivatives = []
+        for format in formats:
+            (ext, mime) = self.handler.formats[format]
+            for derived_width in sorted(set(min(int(w), width) for w in settings['widths'])):
+                derived_path = dest_path.parent.joinpath("%s-%d%s" % (dest_path.namebase, derived_width, ext))
+                derivatives.append(dict(width=derived_width,
+                                        height=max(1, int(round(height * derived_width / float(width)))),
+                                        format=format, type=mime, path=derived_path,
+                                        url=str(self.env.dest_dir.relpathto(derived_path))))
+        return derivatives
+
+    @property
+    def format(self):
+        """
+        PIL format name of the original
+
+        @rtype: str
+        """
+        return self.handler.extension_formats[self.file_path.ext.lower()]
+
+    def srcset(self, prefix='', format=None):
+        """
+        srcset attribute value listing the derivatives in one format, the first configured one unless told otherwise
+
+        @param prefix: Put in front of each URL, usually to_root
+        @type prefix: str|unicode
+        @param format: PIL format name
+        @type format: str|None
+        @rtype: str
+        """
+        derivatives = self.derivatives
+        if not derivatives:
+            return ''
+        format = format or derivatives[0]['format']
+        return ", ".join("%s %dw" % (posixpath.join(prefix, d['url']), d['width'])
+                         for d in derivatives if d['format'] == format)
+
+    def sources(self, prefix=''):
+        """
+        A MIME type and srcset for each format, for the <source> elements of a <picture>
+
+        @param prefix: Put in front of each URL, usually to_root
+        @type prefix: str|unicode
+        @return: Dicts of type and srcset
+        @rtype: list
+        """
+        formats = []
+        for d in self.derivatives:
+            if d['format'] not in formats:
+                formats.append(d['format'])
+        return [dict(type=self.handler.formats[format][1], srcset=self.srcset(prefix, format)) for format in formats]
+
+    def dependencies(self):
+        """
+        The image and the _index.yml its settings come from
+
+        @return: Source paths
+        @rtype: list
+        """
+        return [self.file_path, self.file_path.parent.joinpath('_index.yml')]
+
+    def write_to(self, file_path):
+        """
+        Publish the image to the given path, and queue up its derivatives to go alongside it
+
+        @param file_path: Path to write to
+        @type file_path: path
+        """
+        settings = self.settings
+        if settings['original']:
+            self.ensure_output_dir(file_path)
+            self.env.publisher.publish(self.file_path, file_path)
+
+        for derivative in self.derivatives_for(file_path):
+            self.handler.derive(self.file_path, derivative, int(settings['quality']))
+
+    def output_paths(self, file_path):
         """
-        Write out a compiled version of the .less file to a given path
+        The original, unless it's left out, and the derivatives
 
-        @param file_path: Path for .css file
+        @param file_path: Path passed to write_to
         @type file_path: path
+        @return: Written paths
+        @rtype: list
         """
-        self.ensure_output_dir(file_path)
-        output_file_path = file_path.stripext() + '.css'
-
-        os.system("lessc %s %s" % (self.file_path, output_file_path))
+        paths = [file_path] if self.settings['original'] else []
+        return paths + [derivative['path'] for derivative in self.derivatives_for(file_path)]
 
 
 class BaseTypeHandler(object):
@@ -793,6 +3740,8 @@ class BaseType(object):
     """
     Base class for a Directory Type
     """
+    processed = False
+
     def __init__(self, env, handler, dir_path, meta):
         """
         Init the type with the current env and handler
@@ -811,26 +3760,39 @@ class BaseType(object):
         self.handler = handler
         self.dir_path = dir_path
         self.meta = meta
+        self.deps = dict()
 
-    def process(self):
+    def plan(self, plan):
         """
-        Perform whatever processing the type needs to do
+        Add the nodes for this directory to the build plan
+
+        @param plan: Build plan
+        @type plan: BuildPlan
         """
         raise NotImplementedError()
 
-    def dispatch_dirs(self):
+    def process(self):
+        """
+        Perform whatever processing the type needs to do before its outputs can be written. This happens at most once
+        per build, either when the plan reaches the type's node or when a template asks for the type first.
+        """
+        pass
+
+    def plan_dirs(self, plan):
         """
-        Helper to dispatch dirs
+        Helper to plan sub-dirs
         """
 
-        for d in self.dir_path.dirs():
-            if d.startswith('_'):
+        for d in self.env.sources.dirs(self.dir_path):
+            if d.name.startswith('_'):
                 log.debug("Ignoring directory %s" % d)
                 continue
 
             full_path = self.dir_path.joinpath(d)
 
-            self.env.dispatch_type(full_path)
+            type_ = self.env.load_type(full_path)
+            if type_ is not None:
+                type_.plan(plan)
 
 
 class DefaultTypeHandler(BaseTypeHandler):
@@ -850,23 +3812,24 @@ class DefaultTypeHandler(BaseTypeHandler):
 
 
 class DefaultType(BaseType):
-    def process(self):
+    def plan(self, plan):
         """
-        Process a directory
+        Plan an output for every file in the directory
         """
 
-        for fn in self.dir_path.files():
+        type_node = plan.add(TypeNode(self.env, self.dir_path))
+
+        for fn in self.env.sources.files(self.dir_path):
             if fn.name.startswith('_'):
                 # Ignore files starting with _
                 log.debug("Ignoring file %s" % fn)
                 continue
 
-            log.debug("Getting file %s" % fn)
-            f = self.env.get(fn)
-            log.debug("Writing conversion of file %s" % fn)
-            f.write_to(self.env.to_dest(fn))
+            log.debug("Planning file %s" % fn)
+            plan.add(OutputNode(self.env, plan.add(SourceNode(self.env, fn)), self.env.to_dest(fn),
+                                requires=[type_node]))
 
-        self.dispatch_dirs()
+        self.plan_dirs(plan)
 
 
 class BlogTypeHandler(BaseTypeHandler):
@@ -897,7 +3860,10 @@ class BlogPost(object):
     title = None
     filename = None
     file_path = None
-    html = None
+    content = None
+    retain = True
+    deps = None
+    words_per_minute = 200
 
     def load_from(self, env, full_path):
         """
@@ -919,31 +3885,99 @@ class BlogPost(object):
 
         return True
 
-    def parse_content(self):
+    @property
+    def html(self):
         """
-        Open and parse the content of this blog post
+        The post as HTML, converted when first asked for. A post that isn't retained converts every time it's asked
+        (the Markdown cache keeps that cheap) rather than holding on to its HTML.
+
+        @rtype: str|unicode
         """
-        handler = self.env.get(self.file_path)
-        self.html = handler.as_html()
+        if self.content is not None:
+            self.env.depend_all(self.deps)
+            return self.content
+
+        # Whatever the conversion reads is a dependency of anything using the HTML, even once it's kept
+        if self.env.cache:
+            self.env.cache.begin()
+        try:
+            html = self.env.get(self.file_path).as_html()
+        finally:
+            if self.env.cache:
+                self.deps = self.env.cache.end()
+        self.env.depend_all(self.deps)
+
+        if self.retain:
+            self.content = html
+        return html
 
+    def summarise(self):
+        """
+        Summary of the post from the document summary index, so listings don't need to convert and parse every post
+        every time
 
-class BlogType(BaseType):
-    posts = None
+        @return: Summary, see BuildEnvironment.summarise
+        @rtype: dict
+        """
+        return self.env.summary(self.file_path)
 
-    def __init__(self, env, handler, dir_path, meta):
+    @property
+    def excerpt(self):
         """
-        Init blog type
+        Text of the first paragraph
+
+        @rtype: unicode
         """
-        super(BlogType, self).__init__(env, handler, dir_path, meta)
-        self.posts = []
+        return self.summarise()['excerpt']
 
-    def process(self):
+    @property
+    def first_heading(self):
+        """
+        Text of the first heading
+
+        @rtype: unicode
+        """
+        headings = self.summarise()['headings']
+        return headings[0]['text'] if headings else u''
+
+    @property
+    def word_count(self):
+        """
+        Number of words in the post
+
+        @rtype: int
+        """
+        return self.summarise()['word_count']
+
+    @property
+    def reading_time(self):
+        """
+        Minutes it takes to read the post, at least one
+
+        @rtype: int
+        """
+        return max(1, int(round(self.word_count / float(self.words_per_minute))))
+
+    def release(self):
+        """
+        Let go of the post's HTML, it gets converted again if it's asked for
         """
-        Process the blog directory, generating an index of posts suitable for use by the renderers
+        self.content = None
+        self.retain = False
+
+
+class BlogType(BaseType):
+    posts = None
+
+    def find_posts(self):
+        """
+        Find the posts in the blog directory, going by filename alone
         """
+        if self.posts is not None:
+            return
 
-        # Find posts
-        for fn in self.dir_path.files():
+        self.posts = []
+        for fn in self.env.sources.files(self.dir_path):
             # Matches blog pattern?
             log.debug("Hunting for blog post in %s" % fn.name)
             post = BlogPost()
@@ -956,23 +3990,170 @@ class BlogType(BaseType):
         # Sort posts
         self.posts.sort(lambda a, b: cmp(a.posted, b.posted))
 
-        # Obtain content for each post in first pass
-        for post in self.posts:
-            post.parse_content()
+    def plan(self, plan):
+        """
+        Plan an output for every post plus the index, all waiting on the type node to parse the posts. With a
+        page_size in _index.yml the index is split into pages of that many posts, see plan_pages.
+        """
+        self.find_posts()
+        type_node = plan.add(TypeNode(self.env, self.dir_path))
+
+        post_renderer = plan.add(SourceNode(self.env, self.dir_path.joinpath(self.meta['post_renderer'])))
+        index_path = self.dir_path.joinpath(self.meta['index_renderer'])
+        # The renderers and paging come from _index.yml, so changing it changes every output
+        meta_path = self.dir_path.joinpath('_index.yml')
+        if self.meta.get('page_size'):
+            self.plan_pages(plan, type_node, post_renderer, index_path)
+        else:
+            for post in self.posts:
+                plan.add(OutputNode(self.env, post_renderer, self.env.to_dest(post.file_path),
+                                    requires=[type_node], extra_deps=[post.file_path, meta_path], post=post))
+
+            # A new post changes the index, even though nothing the index already depends on has changed
+            plan.add(OutputNode(self.env, plan.add(SourceNode(self.env, index_path)), self.env.to_dest(index_path),
+                                requires=[type_node],
+                                extra_deps=[('dir', self.dir_path), meta_path] +
+                                           [post.file_path for post in self.posts],
+                                posts=self.posts))
 
-        # Render all the posts
-        # Get the renderer
-        post_renderer = self.env.get(self.dir_path.joinpath(self.meta['post_renderer']))
+        self.plan_dirs(plan)
+
+    def page_path(self, index_path, page):
+        """
+        Destination for a page of the index, the first page goes where an unpaginated index would
+
+        @param index_path: Index renderer
+        @type index_path: path
+        @param page: Page number, from 1
+        @type page: int
+        @return: Destination path
+        @rtype: path
+        """
+        dest_path = self.env.to_dest(index_path)
+        if page == 1:
+            return dest_path
+        return dest_path.parent.joinpath("%s-%d%s" % (dest_path.namebase, page, dest_path.ext))
+
+    def plan_pages(self, plan, type_node, post_renderer, index_path):
+        """
+        Plan the posts a page at a time, each page of the index straight after the posts on it. Posts only hold on to
+        their HTML while their page of the index is rendered, so memory use goes with the page size rather than the
+        number of posts.
+
+        The index renderer gets the posts on the page as posts, the page number (from 1) as page and the URLs of
+        every page, relative to the root, as pages.
+
+        @param plan: Build plan
+        @type plan: BuildPlan
+        @param type_node: Node processing this directory
+        @type type_node: TypeNode
+        @param post_renderer: Node loading the post renderer
+        @type post_renderer: SourceNode
+        @param index_path: Index renderer
+        @type index_path: path
+        """
+        page_size = int(self.meta['page_size'])
+        chunks = [self.posts[i:i + page_size] for i in range(0, len(self.posts), page_size)] or [[]]
+        pages = [str(self.env.dest_dir.relpathto(self.page_path(index_path, page)))
+                 for page in range(1, len(chunks) + 1)]
         for post in self.posts:
-            log.debug("Writing post %s to %s" % (post.title, self.env.map(post.file_path)))
-            post_renderer.write_to(self.env.to_dest(post.file_path), post=post)
+            post.retain = False
+
+        meta_path = self.dir_path.joinpath('_index.yml')
+        index_renderer = SourceNode(self.env, index_path)
+        for (i, chunk) in enumerate(chunks):
+            for post in chunk:
+                plan.add(OutputNode(self.env, post_renderer, self.env.to_dest(post.file_path),
+                                    requires=[type_node], extra_deps=[post.file_path, meta_path], post=post))
+
+            plan.add(BlogPageNode(self.env, plan.add(index_renderer), self.page_path(index_path, i + 1),
+                                  requires=[type_node],
+                                  extra_deps=[('dir', self.dir_path), meta_path] + [post.file_path for post in chunk],
+                                  posts=chunk, page=i + 1, pages=pages))
+
+    def process(self):
+        """
+        Process the blog directory, generating an index of posts suitable for use by the renderers. The content of
+        each post is only converted when something asks for it.
+        """
+        self.find_posts()
 
-        # Render the index
-        index_renderer = self.env.get(self.dir_path.joinpath(self.meta['index_renderer']))
-        index_renderer.write_to(self.env.to_dest(self.dir_path.joinpath(self.meta['index_renderer'])), posts=self.posts)
 
-        # Dispatch sub-dirs
-        self.dispatch_dirs()
+class GalleryTypeHandler(BaseTypeHandler):
+    def match(self, dir_path, meta):
+        """
+        Match against gallery dirs
+        """
+        if meta.get('type', None) == 'gallery':
+            return True
+
+    def load(self, dir_path, meta):
+        """
+        Load a gallery dir
+        """
+        return GalleryType(self.env, self, dir_path, meta)
+
+
+class GalleryType(BaseType):
+    """
+    A directory of images with an index page. The images get derivatives in the widths given by images in
+    _index.yml, or the default ones, and the index renderer (index.jinja2 unless index_renderer says otherwise) gets
+    the images, sorted by name, as images.
+    """
+    images = None
+    default_widths = [320, 640, 1280]
+
+    def __init__(self, env, handler, dir_path, meta):
+        """
+        Init the gallery, filling in the default image settings
+        """
+        meta = dict(meta)
+        meta['images'] = dict(meta.get('images') or dict())
+        meta['images'].setdefault('widths', self.default_widths)
+        super(GalleryType, self).__init__(env, handler, dir_path, meta)
+
+    def find_images(self):
+        """
+        Find the images in the gallery directory, going by the handler each file gets
+        """
+        if self.images is not None:
+            return
+
+        self.images = []
+        for fn in sorted(self.env.sources.files(self.dir_path)):
+            full_path = self.dir_path.joinpath(fn)
+            if not fn.name.startswith('_') and isinstance(self.env.find_handler(full_path), ImageFileHandler):
+                self.images.append(self.env.get(full_path))
+
+    def plan(self, plan):
+        """
+        Plan an output for every file in the directory, with the index waiting on the type node to find the images
+        """
+        self.find_images()
+        type_node = plan.add(TypeNode(self.env, self.dir_path))
+        index_path = self.dir_path.joinpath(self.meta.get('index_renderer', 'index.jinja2'))
+
+        for fn in self.env.sources.files(self.dir_path):
+            full_path = self.dir_path.joinpath(fn)
+            if fn.name.startswith('_') or full_path == index_path:
+                continue
+            plan.add(OutputNode(self.env, plan.add(SourceNode(self.env, full_path)), self.env.to_dest(full_path),
+                                requires=[type_node]))
+
+        if self.env.sources.stat(index_path) is not None:
+            # A new image changes the index, even though nothing the index already depends on has changed
+            plan.add(OutputNode(self.env, plan.add(SourceNode(self.env, index_path)), self.env.to_dest(index_path),
+                                requires=[type_node],
+                                extra_deps=[('dir', self.dir_path)] + [image.file_path for image in self.images],
+                                images=self.images))
+
+        self.plan_dirs(plan)
+
+    def process(self):
+        """
+        Process the gallery directory, finding its images. Nothing about them is read until something asks.
+        """
+        self.find_images()
 
 
 class PathMapBase(object):
@@ -1050,16 +4231,241 @@ class MarkdownPathMap(PathMapBase):
         return file_path.stripext() + '.html'
 
 
-def watch_and_build(source_dir, destination_dir):
+class PathTable(object):
+    """
+    Where every file in the source index maps to, worked out once with the path mappers, plus the reverse from
+    destination back to source. The table is kept up to date from the same changed paths as the source index, so
+    paths are only mapped again when files appear.
+    """
+    env = None
+
+    def __init__(self, env):
+        """
+        Map every file in the source index
+
+        @param env: Build environment, for its path mappers and source index
+        @type env: BuildEnvironment
+        """
+        self.env = env
+        self.forward = dict()
+        self.reverse = dict()
+        for (file_path, entry) in env.sources.entries.items():
+            if not entry.is_dir:
+                self.add(file_path)
+
+    def relative(self, file_path):
+        """
+        Run the path mappers on a path
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        @return: Relative destination path
+        @rtype: path|None
+        """
+        file_path = self.env.source_dir.relpathto(file_path)
+        log.debug("Looking for mapper for %s" % file_path)
+
+        for mapper in self.env.mappers:
+            with self.env.profiler.measure(('mapper', mapper.__class__.__name__)):
+                if mapper.match(file_path):
+                    log.debug("Found mapper %r" % mapper)
+                    return mapper.relative(file_path)
+
+    def add(self, file_path):
+        """
+        Map a path and add it to the table. Only files in the source index go into the reverse index.
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        @return: Relative destination path
+        @rtype: path|None
+        """
+        dest_rel = self.relative(file_path)
+        self.forward[file_path] = dest_rel
+        if file_path in self.env.sources.entries:
+            self.reverse[str(dest_rel)] = file_path
+        return dest_rel
+
+    def drop(self, file_path):
+        """
+        Take a path, and anything beneath it, out of the table
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        """
+        if file_path in self.forward:
+            dropped = [file_path]
+        else:
+            # Perhaps a directory
+            dropped = [p for p in self.forward if p.startswith(file_path + os.sep)]
+
+        for p in dropped:
+            dest_rel = str(self.forward.pop(p))
+            if self.reverse.get(dest_rel) == p:
+                del self.reverse[dest_rel]
+
+    def update(self, paths):
+        """
+        Bring the table up to date with the source index after the given paths changed
+
+        @param paths: Changed paths
+        @type paths: set|list
+        """
+        for file_path in (path(p).abspath() for p in paths):
+            self.drop(file_path)
+            pending = [file_path]
+            while pending:
+                entry = self.env.sources.entries.get(pending.pop())
+                if entry and entry.is_dir:
+                    pending.extend(entry.file_path.joinpath(name) for name in entry.names)
+                elif entry:
+                    self.add(entry.file_path)
+
+    def map(self, file_path):
+        """
+        Look up where a source path maps to, mapping it now if it isn't in the table yet
+
+        @param file_path: Absolute source path
+        @type file_path: path
+        @return: Relative destination path
+        @rtype: path|None
+        """
+        dest_rel = self.forward.get(file_path)
+        if dest_rel is None:
+            dest_rel = self.add(file_path)
+        return dest_rel
+
+
+class RebuildScheduler(object):
+    """
+    Collects file change events in monitor mode and turns them into as few rebuilds as possible.
+
+    Events are coalesced until nothing has changed for the quiet window, then a single rebuild runs with the set of
+    paths that changed. Events that arrive during a rebuild are folded into one follow-up rebuild rather than queueing
+    a rebuild each. Editor temporary files and anything under the ignored directories (such as the destination) never
+    trigger a rebuild.
+
+    A rebuild is told about everything that changed since the last one that succeeded. Builds take files that aren't
+    in the set as unchanged, so a change whose rebuild failed has to go round again.
+    """
+    # Swap, backup and lock files that editors create and remove around a save
+    ignore_patterns = ('*.swp', '*.swo', '*.swx', '*~', '.#*', '#*#', '4913', '*.tmp', '*.kate-swp', '.DS_Store',
+                       '___jb_*___')
+
+    quiet = 0.3
+
+    def __init__(self, build, ignore_dirs=None, quiet=None):
+        """
+        @param build: Called with the set of changed paths to rebuild
+        @type build: callable
+        @param ignore_dirs: Directories whose contents never trigger a rebuild
+        @type ignore_dirs: list|None
+        @param quiet: Seconds without changes to wait for before rebuilding
+        @type quiet: float|None
+        """
+        self.build = build
+        self.ignore_dirs = [path(d).abspath() for d in (ignore_dirs or [])]
+        if quiet is not None:
+            self.quiet = quiet
+        self.pending = set()
+        self.failed = set()
+        self.last_change = None
+        self.condition = threading.Condition()
+
+    def ignored(self, file_path):
+        """
+        Should a change to this path be ignored?
+
+        @param file_path: Changed path
+        @type file_path: str|unicode
+        @rtype: bool
+        """
+        file_path = path(file_path).abspath()
+        for pattern in self.ignore_patterns:
+            if fnmatch.fnmatch(file_path.name, pattern):
+                return True
+        for d in self.ignore_dirs:
+            if file_path == d or file_path.startswith(d + os.sep):
+                return True
+        return False
+
+    def notify(self, paths):
+        """
+        Note that some paths changed. Safe to call from any thread.
+
+        @param paths: Changed paths
+        @type paths: list
+        """
+        paths = set(path(p).abspath() for p in paths if p and not self.ignored(p))
+        if not paths:
+            return
+
+        with self.condition:
+            self.pending.update(paths)
+            self.last_change = time.time()
+            self.condition.notify()
+
+    def next_batch(self):
+        """
+        Wait for changes, then for the quiet window to pass, and take everything that changed
+
+        @return: Changed paths
+        @rtype: set
+        """
+        with self.condition:
+            while True:
+                if self.pending:
+                    remaining = self.last_change + self.quiet - time.time()
+                    if remaining <= 0:
+                        batch = self.pending
+                        self.pending = set()
+                        return batch
+                    self.condition.wait(remaining)
+                else:
+                    # Wake up now and then so ^C gets through
+                    self.condition.wait(1)
+
+    def take(self):
+        """
+        Take everything that's changed so far, without waiting
+
+        @return: Changed paths
+        @rtype: set
+        """
+        with self.condition:
+            batch = self.pending
+            self.pending = set()
+            return batch
+
+    def run(self):
+        """
+        Rebuild whenever changes settle down, forever
+        """
+        while True:
+            changed = self.next_batch()
+            log.warn("Change detected in %d file(s). Rebuilding" % len(changed))
+            try:
+                self.build(changed | self.failed)
+            except Exception:
+                # Keep watching, the next save will probably fix it
+                log.exception("Rebuild failed")
+                self.failed.update(changed)
+            else:
+                self.failed = set()
+
+
+def watch(source_dir, scheduler):
     """
-    This is the autobuilder, which requires the watchdog package to work. Because we don't really want to
-    *require* watchdog in case people are on funny platforms, we test for existence and only define then.
+    Start watching the source directory, passing every change on to the scheduler. This requires the watchdog package
+    to work. Because we don't really want to *require* watchdog in case people are on funny platforms, we test for
+    existence and only define then.
 
     @param source_dir: Source directory
     @type source_dir: str|unicode
-    @param destination_dir: Destination directory
-    @type destination_dir: str|unicode
-
+    @param scheduler: Scheduler to tell about changes
+    @type scheduler: RebuildScheduler
+    @return: Running observer
+    @rtype: watchdog.observers.Observer
     """
 
     try:
@@ -1069,68 +4475,298 @@ def watch_and_build(source_dir, destination_dir):
     except ImportError:
         watchdog = None
     if not watchdog:
-        log.error("Cannot auto-build, you need the watchdog package installed. Try pip install watchdog")
+        log.error("Cannot watch for changes, you need the watchdog package installed. Try pip install watchdog")
         sys.exit(1)
 
     class FileChangeEventHandler(watchdog.events.FileSystemEventHandler):
         """
         File change event handler for triggering a build on file change
         """
-        source_dir = None
-        destination_dir = None
+        scheduler = None
 
-        def __init__(self, source_dir, destination_dir):
+        def __init__(self, scheduler):
             """
             Set up event handler
 
-            @param source_dir: Source directory
-            @type source_dir: str|unicode
-            @param destination_dir: Destination directory
-            @type destination_dir: str|unicode
+            @param scheduler: Rebuild scheduler
+            @type scheduler: RebuildScheduler
             """
-            self.source_dir = source_dir
-            self.destination_dir = destination_dir
+            self.scheduler = scheduler
 
         def on_any_event(self, event):
             """
-            Call build
+            Pass the changed path(s) on to the scheduler
 
             @param event: Event
             @type event: watchdog.events.FileSystemEvent
             """
-            log.warn("Change detected. Rebuilding")
-            perform_build(self.source_dir, self.destination_dir)
+            self.scheduler.notify([event.src_path, getattr(event, 'dest_path', None)])
+
+    observer = watchdog.observers.Observer()
+    observer.schedule(FileChangeEventHandler(scheduler), path=source_dir, recursive=True)
+    observer.start()
+    return observer
+
+
+def watch_and_build(source_dir, destination_dir, quiet=None, **options):
+    """
+    This is the autobuilder, which rebuilds whenever something in the source directory changes
+
+    @param source_dir: Source directory
+    @type source_dir: str|unicode
+    @param destination_dir: Destination directory
+    @type destination_dir: str|unicode
+    @param quiet: Seconds without changes to wait for before rebuilding
+    @type quiet: float|None
+    @param options: Build options, as for perform_build. full only applies to the first run.
+
+    """
+
+    # Walk the source tree once, then keep the index up to date from the changes we're told about
+    sources = SourceIndex(source_dir)
+
+    def rebuild(changed):
+        sources.update(changed)
+        perform_build(source_dir, destination_dir, changed=changed, sources=sources, **dict(options, full=False))
+
+    ignore_dirs = [destination_dir]
+    if options.get('cache_dir'):
+        ignore_dirs.append(options['cache_dir'])
+    scheduler = RebuildScheduler(rebuild, ignore_dirs=ignore_dirs, quiet=quiet)
+    observer = watch(source_dir, scheduler)
 
     print "Monitoring source directory and rebuilding on change. ^C to stop"
 
     # Do one run immediately
-    perform_build(source_dir, destination_dir)
+    perform_build(source_dir, destination_dir, sources=sources, **options)
 
-    observer = watchdog.observers.Observer()
-    observer.schedule(FileChangeEventHandler(source_dir, destination_dir), path=source_dir, recursive=True)
-    observer.start()
     try:
-        while True:
-            time.sleep(1)
+        scheduler.run()
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
 
 
-def perform_build(source_dir, destination_dir):
+class DevServer(object):
     """
-    Perform a single build
+    Development server that renders each page when it's asked for, rather than building the whole site.
+
+    A warm builder and its build plan are kept in memory, and a requested URL is looked up in the plan to find the
+    output that makes it. Only that output (and whatever it requires, such as its directory type) is rendered, into
+    the destination directory. The build cache then keeps it until something it depends on changes, so refreshing an
+    unchanged page costs a few stats. Changes to the source directory are picked up before the next request by
+    setting up a fresh builder, which carries over what the old one's build cache knew.
+
+    The builders aren't told which files changed. Pages that weren't asked for since an earlier change would still
+    need to see it, so every source file is checked by size and mtime against the in-memory source index instead.
+    """
+    source_dir = None
+    destination_dir = None
+    builder = None
+    plan = None
+
+    def __init__(self, source_dir, destination_dir, **options):
+        """
+        @param source_dir: Source directory
+        @type source_dir: str|unicode
+        @param destination_dir: Destination directory
+        @type destination_dir: str|unicode
+        @param options: Options to create_builder
+        """
+        self.source_dir = source_dir
+        self.destination_dir = destination_dir
+        self.options = options
+        self.sources = SourceIndex(source_dir)
+        self.lock = threading.Lock()
+
+        ignore_dirs = [destination_dir]
+        if options.get('cache_dir'):
+            ignore_dirs.append(options['cache_dir'])
+        self.scheduler = RebuildScheduler(None, ignore_dirs=ignore_dirs)
+        self.load()
+
+    def load(self):
+        """
+        Set up a fresh builder and plan, keeping what the previous builder's cache knew
+        """
+        previous = self.builder
+        self.builder = create_builder(self.source_dir, self.destination_dir, sources=self.sources, **self.options)
+        cache = self.builder.env.cache
+        if cache:
+            # Pages are only rendered when asked for, so never throw away what's already in the destination
+            cache.full = False
+            if previous:
+                cache.previous = previous.env.cache.previous
+                cache.stats = previous.env.cache.stats
+                cache.facts = previous.env.cache.facts
+
+        self.plan = self.builder.plan()
+        self.outputs = dict()
+        for node in self.plan.nodes:
+            if isinstance(node, OutputNode):
+                self.outputs.setdefault(node.dest_path.stripext(), []).append(node)
+
+    def find(self, rel):
+        """
+        Find the node producing an output. Outputs with a different name to their node (such as stylesheets compiled
+        from .less files, or resized images named after their width) are found by loading the files that could produce
+        them.
+
+        @param rel: Destination-relative path
+        @type rel: str
+        @return: Output node, or None
+        @rtype: OutputNode|None
+        """
+        node = self.plan.by_name.get("output:%s" % rel)
+        if node:
+            return node
+
+        dest_path = self.builder.env.dest_dir.joinpath(rel)
+        stem = dest_path.stripext()
+        candidates = self.outputs.get(stem, []) + self.outputs.get(path(re.sub(r'-\d+$', '', stem)), [])
+        for node in candidates:
+            self.plan.run(node.source)
+            if dest_path in node.source.file.output_paths(node.dest_path):
+                return node
+        return None
+
+    def render(self, url_path):
+        """
+        Render whatever is at a URL, unless it's already up to date
+
+        @param url_path: Path part of the URL
+        @type url_path: str
+        @return: Output file, a URL to redirect to, or None if there's nothing there
+        @rtype: path|str|None
+        """
+        rel = posixpath.normpath(urllib.unquote(url_path)).strip('/')
+        if rel in ('', '.'):
+            rel = 'index.html'
+        elif url_path.endswith('/'):
+            rel += '/index.html'
+        if rel.startswith('..'):
+            return None
+
+        with self.lock:
+            changed = self.scheduler.take()
+            if changed:
+                log.warn("Change detected in %d file(s)" % len(changed))
+                self.sources.update(changed)
+                self.load()
+
+            node = self.find(rel)
+            if not node:
+                if self.plan.by_name.get("output:%s/index.html" % rel):
+                    return url_path + '/'
+                return None
+
+            for required in node.requires:
+                self.plan.run(required)
+            self.builder.env.renders = 0
+            node.run()
+            self.builder.env.finish()
+
+            cache = self.builder.env.cache
+            if cache:
+                # Later requests check against what was rendered just now
+                cache.previous.update(cache.outputs)
+
+        return self.builder.env.dest_dir.joinpath(rel)
+
+    def serve(self, port=8000):
+        """
+        Serve the site on localhost until interrupted
+
+        @param port: Port to listen on
+        @type port: int
+        """
+        dev_server = self
+
+        class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            """
+            Render and send back whatever's asked for
+            """
+
+            def do_GET(self):
+                try:
+                    result = dev_server.render(self.path.split('?', 1)[0])
+                except Exception:
+                    log.exception("Rendering %s failed" % self.path)
+                    self.send_error(500, traceback.format_exc().splitlines()[-1])
+                    return
+
+                if result is None or (isinstance(result, path) and not result.isfile()):
+                    self.send_error(404)
+                elif not isinstance(result, path):
+                    self.send_response(301)
+                    self.send_header('Location', result)
+                    self.end_headers()
+                else:
+                    content = open(result, 'rb').read()
+                    self.send_response(200)
+                    self.send_header('Content-Type', mimetypes.guess_type(result)[0] or 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                log.info(format % args)
+
+        observer = watch(self.source_dir, self.scheduler)
+        http_server = BaseHTTPServer.HTTPServer(('localhost', port), RequestHandler)
+        print "Serving %s on http://localhost:%d/, rendering pages as they're asked for. ^C to stop" % \
+              (self.source_dir, port)
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            observer.stop()
+        observer.join()
+
+
+def create_builder(source_dir, destination_dir, cache_dir=None, full=False, explain=False, render_budget=None,
+                   publish='copy', dedupe=False, changed=None, sources=None, profile=False, image_cache=None):
+    """
+    Set up a Builder with the standard handlers, mappers and types
 
     @param source_dir: Source directory
     @type source_dir: str|unicode
     @param destination_dir: Destination directory
     @type destination_dir: str|unicode
+    @param cache_dir: Build cache directory, or None to always build everything
+    @type cache_dir: str|unicode|None
+    @param full: Ignore the build cache and rebuild everything
+    @type full: bool
+    @param explain: Print why each output is rebuilt
+    @type explain: bool
+    @param render_budget: Most templates a single output may render, or None for no limit
+    @type render_budget: int|None
+    @param publish: How to publish static files, see Publisher
+    @type publish: str
+    @param dedupe: Store static files with identical content once in the destination
+    @type dedupe: bool
+    @param changed: Source paths known to have changed since the last build, if we know. Anything else is assumed
+        to be unchanged.
+    @type changed: set|None
+    @param sources: Index of the source directory, if one is already up to date
+    @type sources: SourceIndex|None
+    @param profile: Record where the build spends its time
+    @type profile: bool
+    @param image_cache: Most megabytes of image derivatives to keep in the build cache, or None for no limit
+    @type image_cache: int|None
+    @return: Builder
+    @rtype: Builder
     """
-    print "Building from %s to %s" % (source_dir, destination_dir)
-    builder = Builder(source_dir, destination_dir)
+    builder = Builder(source_dir, destination_dir, cache_dir=cache_dir, full=full, explain=explain, sources=sources)
+    builder.env.render_budget = render_budget
+    builder.env.image_cache_bytes = image_cache * 1024 * 1024 if image_cache is not None else None
+    builder.env.publisher = Publisher(builder.env, mode=publish, dedupe=dedupe)
+    builder.env.profiler = Profiler(enabled=profile)
+    if builder.env.cache and changed is not None:
+        builder.env.cache.changed = set(path(p).abspath() for p in changed)
     builder.register(Jinja2FileHandler)
     builder.register(MarkdownFileHandler)
     builder.register(LessFileHandler)
+    builder.register(ImageFileHandler)
     builder.register(AnyFileHandler)
 
     builder.register_map(Jinja2PathMap)
@@ -1139,10 +4775,101 @@ def perform_build(source_dir, destination_dir):
 
     builder.register_type(DefaultTypeHandler)
     builder.register_type(BlogTypeHandler)
+    builder.register_type(GalleryTypeHandler)
 
-    builder.clean()
-    builder.build()
-    print "Done"
+    # Keep hold of how we were set up, so worker processes can set up an identical builder
+    builder.options = dict(source_dir=source_dir, destination_dir=destination_dir, cache_dir=cache_dir, full=full,
+                           render_budget=render_budget, publish=publish, dedupe=dedupe, changed=changed,
+                           profile=profile, image_cache=image_cache)
+    return builder
+
+
+# Builder and plan for this process when it's a worker in a parallel build
+worker_builder = None
+worker_plan = None
+
+
+def init_worker(options):
+    """
+    Set up a worker process for a parallel build with its own builder, handlers and plan
+
+    @param options: Options to create_builder
+    @type options: dict
+    """
+    global worker_builder, worker_plan
+    worker_builder = create_builder(**options)
+    worker_plan = worker_builder.plan()
+
+
+def build_output(name):
+    """
+    Build a single planned output in a worker process
+
+    @param name: Name of the output node
+    @type name: str
+    @return: What the build cache recorded for the output (if there is a build cache), the files produced, the
+        profile and the bytes added to the Markdown cache
+    @rtype: dict
+    """
+    node = worker_plan.by_name[name]
+    worker_plan.run(node)
+    worker_builder.env.finish()
+
+    cache = worker_builder.env.cache
+    profile = worker_builder.env.profiler.dump() if worker_builder.env.profiler.enabled else None
+    produced = worker_builder.env.writer.drain()
+    # The parent trims the Markdown cache, so it needs to know what the worker added to it
+    markdown_written = worker_builder.env.markdown.written
+    worker_builder.env.markdown.written = 0
+    if not cache:
+        return dict(produced=produced, profile=profile, markdown_written=markdown_written)
+
+    rel = str(worker_builder.env.dest_dir.relpathto(node.dest_path))
+    entry = cache.outputs[rel]
+    stats = dict()
+    for dep in entry['deps']:
+        (kind, target) = dep.split(':', 1)
+        if kind == 'file' and target in cache.stats:
+            stats[target] = cache.stats[target]
+
+    facts = cache.learned
+    cache.learned = []
+    return dict(rel=rel, entry=entry, rebuilt=rel in cache.rebuilt, reasons=cache.reasons.get(rel), stats=stats,
+                facts=facts, produced=produced, profile=profile, markdown_written=markdown_written)
+
+
+def perform_build(source_dir, destination_dir, jobs=1, deploy_dir=None, **options):
+    """
+    Perform a single build
+
+    @param source_dir: Source directory
+    @type source_dir: str|unicode
+    @param destination_dir: Destination directory
+    @type destination_dir: str|unicode
+    @param jobs: Number of processes to render with
+    @type jobs: int
+    @param deploy_dir: Where to write a deploy manifest, or None for no manifest
+    @type deploy_dir: str|unicode|None
+    @param options: Passed on to create_builder
+    @return: The builder, once it's done
+    @rtype: Builder
+    """
+    print "Building from %s to %s" % (source_dir, destination_dir)
+    builder = create_builder(source_dir, destination_dir, **options)
+
+    builder.build(jobs=jobs, deploy_dir=deploy_dir)
+    if not builder.env.cache or builder.env.cache.full:
+        builder.sweep()
+
+    if builder.env.cache:
+        print "Done: %d rebuilt, %d skipped" % (len(builder.env.cache.rebuilt), len(builder.env.cache.skipped))
+    else:
+        print "Done"
+
+    if builder.env.profiler.enabled:
+        builder.env.profiler.report(path(options.get('cache_dir') or '.'))
+
+    return builder
 
 
 if __name__ == "__main__":
@@ -1154,10 +4881,44 @@ if __name__ == "__main__":
     parser.add_option("--monitor","-m",
                       help = "Monitor and rebuild whenever changes are detected",
                       action = "store_true")
+    parser.add_option("--serve",
+                      help = "Serve the site on localhost, rendering each page when it's asked for",
+                      action = "store_true")
+    parser.add_option("--port", type="int", default=8000,
+                      help = "Port for --serve")
+    parser.add_option("--quiet-window", type="float", default=RebuildScheduler.quiet,
+                      help = "In monitor mode, seconds without changes to wait for before rebuilding")
     parser.add_option("--source","-s", type="string", default="source",
                       help = "Source directory")
     parser.add_option("--destination","-d", type="string", default="output",
                       help = "Destination directory")
+    parser.add_option("--cache","-c", type="string", default=".statin-cache",
+                      help = "Build cache directory, used to skip unchanged outputs")
+    parser.add_option("--full",
+                      help = "Ignore the build cache and rebuild everything",
+                      action = "store_true")
+    parser.add_option("--explain",
+                      help = "Print why each output is rebuilt",
+                      action = "store_true")
+    parser.add_option("--render-budget", type="int", default=100000,
+                      help = "Most templates a single output may render before the build gives up on it")
+    parser.add_option("--jobs","-j", type="int", default=1,
+                      help = "Number of processes to render with")
+    parser.add_option("--image-cache", type="int", default=256,
+                      help = "Megabytes of resized images to keep in the build cache, least recently used are dropped first")
+    parser.add_option("--publish", type="choice", choices=Publisher.modes, default="copy",
+                      help = "How to publish static files: copy, hardlink, reflink or copy_file_range")
+    parser.add_option("--dedupe",
+                      help = "Store static files with identical content only once in the destination",
+                      action = "store_true")
+    parser.add_option("--deploy-manifest", type="string", default=None,
+                      help = "Write a manifest of the outputs, and lists of what changed since the last one, to this directory")
+    parser.add_option("--profile",
+                      help = "Report where the build spends its time, per file, handler, type, mapper and template global",
+                      action = "store_true")
+    parser.add_option("--precompile",
+                      help = "Compile all templates into the build cache and exit without building",
+                      action = "store_true")
     (options, args) = parser.parse_args()
     if options.verbose:
         log.setLevel(logging.DEBUG)
@@ -1167,9 +4928,21 @@ if __name__ == "__main__":
     source_dir = options.source
     destination_dir = options.destination
 
-    if options.monitor:
-        watch_and_build(source_dir, destination_dir)
+    if options.precompile:
+        builder = create_builder(source_dir, destination_dir, cache_dir=options.cache)
+        print "Precompiled %d templates" % builder.precompile()
+    elif options.serve:
+        DevServer(source_dir, destination_dir, cache_dir=options.cache, render_budget=options.render_budget,
+                  publish=options.publish, dedupe=options.dedupe, image_cache=options.image_cache).serve(port=options.port)
+    elif options.monitor:
+        watch_and_build(source_dir, destination_dir, quiet=options.quiet_window, cache_dir=options.cache,
+                        full=options.full, explain=options.explain, render_budget=options.render_budget, jobs=options.jobs,
+                        publish=options.publish, dedupe=options.dedupe, profile=options.profile,
+                        image_cache=options.image_cache, deploy_dir=options.deploy_manifest)
     else:
-        perform_build(source_dir, destination_dir)
+        perform_build(source_dir, destination_dir, cache_dir=options.cache, full=options.full,
+                      explain=options.explain, render_budget=options.render_budget, jobs=options.jobs,
+                      publish=options.publish, dedupe=options.dedupe, profile=options.profile,
+                      image_cache=options.image_cache, deploy_dir=options.deploy_manifest)
 
 